@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+Flee batch runner
+
+Plays many seeded headless games across a process pool and prints
+aggregate statistics; used to compare tuning changes.
+
+Usage:
+    batch [--games=<n>] [--seed=<n>] [--ticks=<n>] [--processes=<n>]
+          [--swarm] [--flow-field] [--world=<size>] [--spawn-rate=<n>] [--spawn-rate-step=<n>]
+          [--spawn-rate-min=<n>] [--zombie-speed=<n>] [--player-speed=<n>]
+          [--output=<file>]
+    batch -h | --help
+
+Options:
+    -h --help              Show this screen
+    --games=<n>            Number of games to play [default: 1000]
+    --seed=<n>             Seed of the first game; game i uses seed + i [default: 0]
+    --ticks=<n>            Stop a game that survives this many ticks [default: 100000]
+    --processes=<n>        Worker processes [default: all cores]
+    --swarm                Simulate the horde with the NumPy swarm backend
+    --flow-field           Steer the horde with a flow field
+    --world=<size>         Play in a scrolling world of this size, e.g. 3200x2400
+    --spawn-rate=<n>       Ticks between spawns at the start
+    --spawn-rate-step=<n>  How much sooner each next spawn comes
+    --spawn-rate-min=<n>   Stop speeding spawns up at or below this
+    --zombie-speed=<n>     Zombie speed in pixels per tick
+    --player-speed=<n>     Player speed in pixels per tick
+    --output=<file>        Also write every game's result as a JSON line
+"""
+import json
+import multiprocessing
+import sys
+import time
+
+import flee
+
+
+TUNING_OPTIONS = {
+    '--spawn-rate': 'spawn_rate',
+    '--spawn-rate-step': 'spawn_rate_step',
+    '--spawn-rate-min': 'spawn_rate_min',
+    '--zombie-speed': 'zombie_speed',
+    '--player-speed': 'player_speed',
+}
+
+RESULT_FIELDS = ['seed', 'ticks', 'score', 'peak_zombies', 'died']
+
+# Set in each worker by init_worker
+worker_settings = None
+
+
+# ----------------------------------------------------------------------
+# Workers
+# ----------------------------------------------------------------------
+def init_worker(settings):
+    global worker_settings
+    worker_settings = settings
+    flee.init_headless_display()
+
+
+def play(seed):
+    """
+    Plays one game in a worker and returns its result row.
+    """
+    settings = worker_settings
+    result = flee.run_headless(
+        ticks=settings['ticks'],
+        use_swarm=settings['use_swarm'],
+        seed=seed,
+        flow_field=settings['flow_field'],
+        tuning=settings['tuning'],
+        world_size=settings['world_size'],
+    )
+    row = dict((field, result[field]) for field in RESULT_FIELDS)
+    # the seed flee.py --headless --seed takes, not the one the game drew
+    row['seed'] = seed
+    return row
+
+
+# ----------------------------------------------------------------------
+# Reporting
+# ----------------------------------------------------------------------
+def describe(values):
+    values = sorted(values)
+    return {
+        'mean': sum(values) / float(len(values)),
+        'min': values[0],
+        'p50': flee.percentile(values, 50),
+        'p99': flee.percentile(values, 99),
+        'max': values[-1],
+    }
+
+
+def report(results, elapsed, processes):
+    sys.stdout.write(
+        "%d games in %.2f s on %d processes (%.1f games/s), %.1f%% died\n"
+        % (len(results), elapsed, processes, len(results) / elapsed,
+           100.0 * sum(1 for r in results if r['died']) / len(results))
+    )
+    for field in ['ticks', 'score', 'peak_zombies']:
+        stats = describe([r[field] for r in results])
+        sys.stdout.write(
+            "    %-13s mean %10.1f  min %8d  p50 %8d  p99 %8d  max %8d\n"
+            % (field, stats['mean'], stats['min'], stats['p50'], stats['p99'], stats['max'])
+        )
+
+
+def main(args):
+    games = int(args.get('--games') or 1000)
+    first_seed = int(args.get('--seed') or 0)
+    processes = args.get('--processes')
+    if processes in (None, 'all cores'):
+        processes = multiprocessing.cpu_count()
+    processes = int(processes)
+    use_swarm = bool(args.get('--swarm'))
+    if use_swarm and flee.np is None:
+        sys.exit('--swarm needs numpy')
+    tuning = dict(
+        (name, int(args[option]))
+        for option, name in TUNING_OPTIONS.items()
+        if args.get(option) is not None
+    )
+    try:
+        world_size = flee.parse_size(args['--world'], minimum=24) if args.get('--world') else None
+    except ValueError as error:
+        sys.exit('--world: %s' % error)
+    settings = {
+        'ticks': int(args.get('--ticks') or 100000),
+        'use_swarm': use_swarm,
+        'flow_field': bool(args.get('--flow-field')),
+        'world_size': world_size,
+        'tuning': tuning,
+    }
+
+    output = args.get('--output')
+    stream = open(output, 'w') if output else None
+    results = []
+    start = time.time()
+    pool = multiprocessing.Pool(processes, init_worker, (settings,))
+    try:
+        seeds = range(first_seed, first_seed + games)
+        # results come back over the pool's pipes as each game finishes
+        for result in pool.imap_unordered(play, seeds, chunksize=4):
+            results.append(result)
+            if stream is not None:
+                stream.write(json.dumps(result, sort_keys=True) + "\n")
+    finally:
+        pool.close()
+        pool.join()
+        if stream is not None:
+            stream.close()
+    elapsed = time.time() - start
+    if results:
+        report(results, elapsed, processes)
+    return results
+
+
+if __name__ == "__main__":
+    from docopt import docopt
+
+    main(docopt(__doc__))
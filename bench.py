@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+Flee benchmarks
+
+Runs scripted game loop scenarios without a window and reports per-phase
+frame timings, so runs can be compared across commits.
+
+Usage:
+    bench [--swarm] [--ai-budget=<ms>] [--scenario=<name>...] [--frames=<n>] [--seed=<n>] [--output=<file>]
+    bench --list
+    bench -h | --help
+
+Options:
+    -h --help          Show this screen
+    --list             List the available scenarios
+    --swarm            Benchmark the NumPy swarm backend
+    --ai-budget=<ms>   Time-slice the sprite horde's AI within this budget
+    --scenario=<name>  Only run the named scenario (may be repeated)
+    --frames=<n>       Frames per scenario [default: 300]
+    --seed=<n>         Random seed used for every scenario [default: 1]
+    --output=<file>    Also write the results as JSON to this file
+"""
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import flee
+from flee import pg
+
+
+# Big enough that nothing in a benchmark can kill the player
+INVULNERABLE = 10 ** 12
+
+
+# ----------------------------------------------------------------------
+# Scenarios
+# ----------------------------------------------------------------------
+def key_event(etype, key):
+    return pg.event.Event(etype, key=key, mod=0)
+
+
+def circles(frame, leg=15):
+    """
+    Walks the player around a square: east, south, west, north.
+    """
+    keys = [pg.K_RIGHT, pg.K_DOWN, pg.K_LEFT, pg.K_UP]
+    if frame % leg:
+        return []
+    side = (frame // leg) % len(keys)
+    events = [key_event(pg.KEYDOWN, keys[side])]
+    if frame:
+        events.insert(0, key_event(pg.KEYUP, keys[side - 1]))
+    return events
+
+
+class Scenario(object):
+
+    """
+    A scripted run: how many zombies to start with, how the player moves and
+    how hard the horde keeps spawning.
+    """
+
+    def __init__(self, name, zombies=1, movement=None, spawn_per_tick=0, max_frames=None,
+                 fire_per_tick=0):
+        self.name = name
+        self.zombies = zombies
+        self.movement = movement
+        self.spawn_per_tick = spawn_per_tick
+        self.max_frames = max_frames
+        self.fire_per_tick = fire_per_tick
+
+
+SCENARIOS = [
+    Scenario('horde_10', zombies=10),
+    Scenario('horde_100', zombies=100),
+    Scenario('horde_1000', zombies=1000),
+    Scenario('horde_10000', zombies=10000, max_frames=100),
+    Scenario('horde_100000', zombies=100000, max_frames=20),
+    Scenario('player_still', zombies=1),
+    Scenario('player_circles', zombies=100, movement=circles),
+    Scenario('spawn_pressure', zombies=1, spawn_per_tick=4),
+    Scenario('bullet_storm', zombies=1000, spawn_per_tick=8, fire_per_tick=64),
+]
+
+
+# ----------------------------------------------------------------------
+# Runner
+# ----------------------------------------------------------------------
+def git_commit():
+    try:
+        out = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=flee.game_path,
+            stderr=subprocess.STDOUT,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode('ascii', 'replace').strip()
+
+
+def run_scenario(scenario, frames, seed, use_swarm, inputs, renderer, digits, ai_budget=None):
+    random.seed(seed)
+    game = flee.Game(None, use_swarm, ai_budget=ai_budget)
+    player = game.player
+    player.health = INVULNERABLE
+    while len(game.zombies) < scenario.zombies:
+        game.zombies.spawn()
+    zombies_start = len(game.zombies)
+    if scenario.max_frames:
+        frames = min(frames, scenario.max_frames)
+    pg.event.clear()
+    renderer.invalidate()
+    width = renderer.screen_rect.w
+
+    queue = flee.RenderQueue()
+    hud = queue.layer(flee.LAYER_HUD)
+    score_label = flee.HudLabel(digits, "Score: ")
+    zombie_label = flee.HudLabel(digits, "Zombies: ")
+    timer = flee.FrameTimer()
+    for frame in range(frames):
+        timer.begin()
+        if scenario.movement is not None:
+            for event in scenario.movement(frame):
+                pg.event.post(event)
+        for event in inputs.poll():
+            player.handle_event(event)
+        timer.mark('events')
+        for _ in range(scenario.spawn_per_tick):
+            game.zombies.spawn()
+        for shot in range(scenario.fire_per_tick):
+            # a spiral out of the player's center
+            angle = (frame * scenario.fire_per_tick + shot) * 0.37
+            game.bullets.fire(player.rect.centerx, player.rect.centery,
+                              math.cos(angle), math.sin(angle))
+        game.step(timer)
+        label = score_label.set(game.score)
+        zlabel = zombie_label.set(len(game.zombies))
+        timer.mark('text')
+        renderer.begin()
+        game.draw(queue)
+        hud.blit(label, (width - label.get_rect().w - 10, 10))
+        hud.blit(zlabel, (10, 10))
+        queue.flush(renderer)
+        timer.mark('blit')
+        renderer.present()
+        timer.mark('display')
+        timer.end()
+    return {
+        'frames': frames,
+        'zombies_start': zombies_start,
+        'zombies_end': len(game.zombies),
+        'bullets_end': len(game.bullets),
+        'kills': game.kills,
+        'phases': timer.summary(),
+    }
+
+
+def report(name, result):
+    phases = result['phases']
+    frame = phases['frame']
+    sys.stdout.write(
+        "%-16s %6d zombies  frame ms  mean %8.3f  p50 %8.3f  p99 %8.3f  max %8.3f\n"
+        % (name, result['zombies_end'], frame['mean'], frame['p50'], frame['p99'], frame['max'])
+    )
+    for phase in ['events', 'spawn', 'player', 'zombies', 'bullets', 'text', 'blit', 'display']:
+        stats = phases.get(phase)
+        if stats is not None:
+            sys.stdout.write(
+                "    %-12s mean %8.3f  p50 %8.3f  p99 %8.3f  max %8.3f\n"
+                % (phase, stats['mean'], stats['p50'], stats['p99'], stats['max'])
+            )
+
+
+def main(args):
+    if args.get('--list'):
+        for scenario in SCENARIOS:
+            sys.stdout.write("%s\n" % scenario.name)
+        return
+    use_swarm = bool(args.get('--swarm'))
+    if use_swarm and flee.np is None:
+        sys.exit('--swarm needs numpy')
+    try:
+        ai_budget = flee.parse_positive(args['--ai-budget']) if args.get('--ai-budget') else None
+    except ValueError as error:
+        sys.exit('--ai-budget: %s' % error)
+    frames = int(args.get('--frames') or 300)
+    seed = int(args.get('--seed') or 1)
+    wanted = args.get('--scenario') or []
+    unknown = set(wanted) - set(s.name for s in SCENARIOS)
+    if unknown:
+        sys.exit('Unknown scenario(s): %s' % ', '.join(sorted(unknown)))
+
+    window = flee.init_headless_display()
+    font = flee.asset_cache.font(flee.HUD_FONT, 15)
+    digits = flee.GlyphAtlas(font, flee.HUD_COLOR)
+    background = pg.Surface(window.get_size()).convert()
+    background.fill((0, 0, 0))
+    renderer = flee.DirtyRenderer(window, background)
+    inputs = flee.InputStage()
+    inputs.install()
+
+    results = {
+        'version': flee.VERSION,
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pygame': pg.version.ver,
+        'backend': 'swarm' if use_swarm else 'sprites',
+        'seed': seed,
+        'ai_budget': ai_budget,
+        'scenarios': {},
+    }
+    for scenario in SCENARIOS:
+        if wanted and scenario.name not in wanted:
+            continue
+        result = run_scenario(scenario, frames, seed, use_swarm, inputs, renderer, digits,
+                              ai_budget)
+        results['scenarios'][scenario.name] = result
+        report(scenario.name, result)
+    pg.quit()
+
+    output = args.get('--output')
+    if output:
+        with open(output, 'w') as stream:
+            json.dump(results, stream, indent=2, sort_keys=True)
+    return results
+
+
+if __name__ == "__main__":
+    from docopt import docopt
+
+    main(docopt(__doc__))
@@ -3,26 +3,72 @@
 Flee
 
 Usage:
-    diamond_divas
+    diamond_divas [-d | --debug] [--swarm] [--flow-field] [--world=<size>] [--tick-rate=<hz>] [--ai-budget=<ms>] [--profile-seconds=<n>] [--record=<file> | --replay=<file>]
+    diamond_divas --headless [--ticks=<n>] [--seed=<n>] [--replay=<file>] [--swarm] [--flow-field] [--world=<size>] [-d | --debug]
+    diamond_divas --build-assets
     diamond_divas -h | --help
-    diamond_divas -d | --debug
     diamond_divas --version
 
 Options:
     -h --help      Show this screen
     --version      Show version
     -d --debug     Run in debug mode
+    --swarm        Simulate the horde with the NumPy swarm backend
+    --flow-field   Steer the horde with a shared flow field instead of
+                   each zombie heading straight for the player
+    --world=<size>   Play in a scrolling world of this size, e.g. 3200x2400,
+                     with the view following the player
+    --tick-rate=<hz>  Simulation steps per second [default: 60]
+    --ai-budget=<ms>  Time-slice the horde's AI to stay within this many
+                      milliseconds per tick; zombies near the player still
+                      think every tick.  Not replay-exact, so not
+                      allowed with --record or --replay
+    --headless     Simulate without a display, as fast as the CPU allows
+    --ticks=<n>    Stop a headless run after this many ticks
+    --seed=<n>     Seed the random number generator
+    --record=<file>  Record every game's seed and input to a replay file
+    --replay=<file>  Play back the games in a replay file
+    --build-assets   Rebuild the preprocessed asset cache, including the
+                     compiled animation atlas, and exit
+    --profile-seconds=<n>  Seconds of cProfile history kept in debug mode [default: 10]
+
+Debug mode also logs a startup breakdown: import, display and asset setup,
+and the time to the first frame.
+
+Debug keys:
+    F1             Toggle the frame profiler overlay
+    F2             Dump a cProfile capture of the last few seconds
 """
 VERSION = "0.1-dev"
 
+import time
+
+# Start of the import, for the startup report
+import_started = getattr(time, 'perf_counter', time.time)()
+
+import collections
+import gc
+import heapq
+import json
+import mmap
 import random
 import logging
 import math
 import os
+import struct
 import sys
+import threading
+
+# cProfile, pstats, hashlib and plistlib are only needed by debug mode or
+# when the asset cache is rebuilt; they are imported where they are used.
 
 import pygame as pg
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 # ----------------------------------------------------------------------
 # Utility Structures
@@ -42,52 +88,239 @@ keyboard_controls = {
     'move_backward': [],
 }
 
-keyboard_events = [
-    getattr(pg, d)
-    for d in dir(pg)
-    if d.lower().startswith('key')
-]
+# Spelled out rather than found by scanning dir(pg) at import time
+keyboard_events = frozenset([pg.KEYDOWN, pg.KEYUP])
 
-mouse_events = [
-    getattr(pg, d)
-    for d in dir(pg)
-    if d.lower().startswith("mouse")
-]
+mouse_events = frozenset(
+    getattr(pg, name)
+    for name in ['MOUSEMOTION', 'MOUSEBUTTONDOWN', 'MOUSEBUTTONUP', 'MOUSEWHEEL']
+    if hasattr(pg, name)
+)
 
 keyboard_mods = dict(
-    (getattr(pg, d), d.lower().replace('kmod_', ''))
-    for d in dir(pg)
-    if d.lower().startswith('kmod_')
-    if not d.lower().endswith('none')
+    (getattr(pg, 'KMOD_' + name.upper()), name)
+    for name in [
+        'lshift', 'rshift', 'shift', 'lctrl', 'rctrl', 'ctrl', 'lalt', 'ralt',
+        'alt', 'lgui', 'rgui', 'gui', 'lmeta', 'rmeta', 'meta', 'caps', 'num',
+        'mode',
+    ]
+    if hasattr(pg, 'KMOD_' + name.upper())
 )
 
+# Inverse of keyboard_controls: key -> names of the actions it triggers
+key_actions = {}
+for action, keys in keyboard_controls.items():
+    for key in keys:
+        key_actions.setdefault(key, []).append(action)
+
 game_path = os.path.dirname(os.path.abspath(__file__))
 
-KEY_PRESSED = 2
-KEY_RELEASED = 3
+KEY_PRESSED = pg.KEYDOWN
+KEY_RELEASED = pg.KEYUP
 Y_AXIS = 1
 X_AXIS = 0
 
+perf_counter = getattr(time, 'perf_counter', time.time)
+tobytes = getattr(pg.image, 'tobytes', None) or pg.image.tostring
+
 
 # ----------------------------------------------------------------------
 # Utility Functions
 # ----------------------------------------------------------------------
+_resource_index = None
+
+
+def resource_index(rebuild=False):
+    """
+    Maps resource names (with and without extension) to their paths.  The
+    resources folder is only scanned the first time or when rebuilt.
+    """
+    global _resource_index
+    if _resource_index is None or rebuild:
+        index = {}
+        resources = os.path.join(game_path, 'resources')
+        for fname in os.listdir(resources):
+            bname, ext = os.path.splitext(fname)
+            fpath = os.path.join(resources, fname)
+            index.setdefault(fname, fpath)
+            index.setdefault(bname, fpath)
+        _resource_index = index
+    return _resource_index
+
+
 def load_image(filename):
     """
     Loads an image;  guesses the type of image by the extension
     """
-    resources = os.path.join(game_path, 'resources')
-    for fname in os.listdir(resources):
-        bname, ext = os.path.splitext(fname)
-        if filename in [bname, fname]:
-            fpath = os.path.join(resources, fname)
-            image = pg.image.load(fpath)
-            if image.get_alpha() is None:
-                image = image.convert()
-            else:
-                image = image.convert_alpha()
-            return image, image.get_rect()
-    return [None, None]
+    fpath = resource_index().get(filename)
+    if fpath is None:
+        return [None, None]
+    image = asset_cache.image(filename)
+    if image is None:
+        image = pg.image.load(fpath)
+    image = prepare_surface(image)
+    return image, image.get_rect()
+
+
+# Stands in for transparent pixels of all-or-nothing alpha images
+COLORKEY = (255, 0, 255)
+
+
+def prepare_surface(surface):
+    """
+    Returns a copy of surface in the display's pixel format, set up for
+    the fastest blit that keeps it looking the same.
+
+    Opaque images are plainly converted.  Images whose alpha is all or
+    nothing become RLE colorkeyed surfaces; anything with partial
+    transparency keeps per-pixel alpha, also RLE accelerated.  Without a
+    display the surface is returned as it is.
+    """
+    if pg.display.get_surface() is None:
+        return surface
+    if not surface.get_flags() & pg.SRCALPHA:
+        colorkey = surface.get_colorkey()
+        surface = surface.convert()
+        if colorkey is not None:
+            surface.set_colorkey(colorkey, pg.RLEACCEL)
+        return surface
+    pixels = tobytes(surface, 'RGBA')
+    alphas = set(pixels[3::4])
+    if alphas <= set([255]):
+        return surface.convert()
+    # (the count can over-match across pixel boundaries; that only costs
+    # the colorkey path, never correctness)
+    if alphas <= set([0, 255]) and not pixels.count(bytes(bytearray(COLORKEY + (255,)))):
+        keyed = pg.Surface(surface.get_size()).convert()
+        keyed.fill(COLORKEY)
+        keyed.blit(surface, (0, 0))
+        keyed.set_colorkey(COLORKEY, pg.RLEACCEL)
+        return keyed
+    surface = surface.convert_alpha()
+    surface.set_alpha(255, pg.RLEACCEL)
+    return surface
+
+
+def matches_display(surface):
+    """
+    Whether surface can be blitted to the display without a per-pixel
+    format conversion.
+    """
+    display = pg.display.get_surface()
+    if display is None:
+        return True
+    return (surface.get_bitsize() == display.get_bitsize() and
+            surface.get_masks()[:3] == display.get_masks()[:3])
+
+
+PXI_TILE = 256
+
+
+def read_pxi(path):
+    """
+    Decodes a Pixen image (.pxi) into a surface, compositing its visible
+    layers from the bottom up.
+    """
+    import plistlib
+
+    with open(path, 'rb') as stream:
+        archive = plistlib.load(stream)
+    objects = archive['$objects']
+
+    def resolve(value):
+        if isinstance(value, plistlib.UID):
+            return objects[value.data]
+        return value
+
+    def mapping(value):
+        value = resolve(value)
+        keys = [resolve(k) for k in value['NS.keys']]
+        return dict(zip(keys, [resolve(v) for v in value['NS.objects']]))
+
+    canvas = resolve(archive['$top']['root'])
+    surface = None
+    for layer in resolve(canvas['layers'])['NS.objects']:
+        layer = resolve(layer)
+        image = mapping(layer['image'])
+        height = image['height']
+        if surface is None:
+            surface = pg.Surface((image['width'], height), pg.SRCALPHA)
+        if not layer.get('visible', True):
+            continue
+        opacity = resolve(layer.get('opacity', 100.0))
+        # tiles are square and positioned from the bottom-left corner
+        for tile in resolve(image['tiles'])['NS.objects']:
+            tile = mapping(tile)
+            tx, ty = [int(float(v)) for v in tile['location'].strip('{}').split(',')]
+            pixels = pg.image.frombuffer(tile['data'], (PXI_TILE, PXI_TILE), 'RGBA')
+            if opacity < 100:
+                pixels = pixels.copy()
+                pixels.fill((255, 255, 255, int(round(2.55 * opacity))), None, pg.BLEND_RGBA_MULT)
+            surface.blit(pixels, (tx, height - ty - PXI_TILE))
+    return surface
+
+
+def read_pxa(path):
+    """
+    Reads a Pixen animation folder (.pxa): its cels in order, each paired
+    with its duration from CelData.plist.
+    """
+    import plistlib
+
+    with open(os.path.join(path, 'CelData.plist'), 'rb') as stream:
+        cels = plistlib.load(stream)
+    return [
+        (read_pxi(os.path.join(path, '%d.pxi' % number)), float(cel.get('duration', 1.0)))
+        for number, cel in enumerate(cels)
+    ]
+
+
+def interpolate(previous, current, alpha):
+    """
+    Blends two (x, y) positions; alpha 0 is previous, 1 is current.
+    """
+    if alpha >= 1:
+        return current[0], current[1]
+    px, py = previous
+    return (int(round(px + (current[0] - px) * alpha)),
+            int(round(py + (current[1] - py) * alpha)))
+
+
+def percentile(samples, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not samples:
+        return 0.0
+    rank = int(math.ceil(pct / 100.0 * len(samples))) - 1
+    return samples[min(max(rank, 0), len(samples) - 1)]
+
+
+def parse_size(text, minimum=1):
+    """
+    Parses a WIDTHxHEIGHT string such as '3200x2400'.  Raises ValueError
+    unless both sides are at least minimum.
+    """
+    try:
+        width, height = [int(part) for part in text.lower().split('x')]
+    except ValueError:
+        raise ValueError('Expected a size like 3200x2400, not %r' % text)
+    if width < minimum or height < minimum:
+        raise ValueError('A size must be at least %dx%d, not %r' % (minimum, minimum, text))
+    return width, height
+
+
+def parse_positive(text):
+    """
+    Parses a positive, finite number such as '60' or '2.5'.
+    """
+    try:
+        value = float(text)
+    except ValueError:
+        raise ValueError('Expected a positive number, not %r' % text)
+    if not value > 0 or math.isinf(value):
+        raise ValueError('Expected a positive number, not %r' % text)
+    return value
 
 
 # ----------------------------------------------------------------------
@@ -100,7 +333,7 @@ class LoggerFacade(object):
     """
 
     def facade(self, *args, **kwds):
-        print >> sys.stderr, " ".join(str(a) for a in args)
+        sys.stderr.write(" ".join(str(a) for a in args) + "\n")
 
 interface = ['log', 'debug', 'info', 'warning', 'error', 'critical',
              'exception', 'filter', 'handle', '__call__']
@@ -111,6 +344,12 @@ for faked in interface:
 class SpriteSheet(object):
     """
     A convenient way to access a sprite sheet
+
+    The sheet is sliced once at load time into a frame table keyed by
+    (column, row); indexing returns the cached frame rather than building
+    a new surface on every call.  Every frame is its own display-format
+    surface (see prepare_surface) rather than a subsurface, so each one
+    can be RLE encoded.
     """
 
     def __init__(self, filename, sprite_size=(24, 24)):
@@ -118,6 +357,35 @@ class SpriteSheet(object):
         self.x_offset = sprite_size[0]
         self.y_offset = sprite_size[1]
         self.sheet, self.rect = load_image(filename)
+        self.frames = {}
+        self.rects = {}
+        self.slice()
+
+    def slice(self):
+        """
+        Builds the frame table from the loaded sheet.
+        """
+        self.frames.clear()
+        self.rects.clear()
+        if self.sheet is None:
+            return
+        columns = self.rect.w // self.x_offset
+        rows = self.rect.h // self.y_offset
+        for x_index in range(columns):
+            for y_index in range(rows):
+                # calculate the column and row
+                new_x = x_index * self.x_offset
+                new_y = y_index * self.y_offset
+                rect = pg.Rect((new_x, new_y, self.x_offset-1, self.y_offset-1))
+                frame = prepare_surface(self.sheet.subsurface(rect).copy())
+                self.frames[(x_index, y_index)] = frame
+                self.rects[(x_index, y_index)] = rect
+
+    def frame(self, x_index, y_index):
+        """
+        Returns the cached frame surface at (column, row).
+        """
+        return self.frames[(x_index, y_index)]
 
     def __getitem__(self, value=(0, 0)):
         """
@@ -130,32 +398,1567 @@ class SpriteSheet(object):
                 images = [self[val] for val in value]
                 return images
             else:
-                x_index, y_index = value
-                # calculate the row
-                new_x = x_index * self.x_offset
-                # x_offset = new_x + self.x_offset - 1
-                # calculate the column
-                new_y = y_index * self.y_offset
-                # y_offset = new_y + self.y_offset - 1
-                # grab the pixels
-                rect = pg.Rect((new_x, new_y, self.x_offset-1, self.y_offset-1))
-                img = pg.Surface(rect.size)
-                img.blit(self.sheet, (0, 0), rect)
-                return img, rect
+                key = tuple(value)
+                img = self.frames.get(key)
+                if img is None:
+                    return [None, None]
+                # callers take ownership of the rect and move it around
+                return img, pg.Rect(self.rects[key])
         return [None, None]
 
 
+class AssetRegistry(object):
+    """
+    Process-wide cache of loaded assets.
+
+    Sprite sheets are loaded the first time they are asked for and the same
+    instance is shared by every entity afterwards.  Call invalidate to force
+    a reload (e.g. after the display mode changes or a resource is edited).
+    """
+
+    def __init__(self):
+        self.sheets = {}
+        self.atlas = None
+
+    def sprite_sheet(self, filename, sprite_size=(24, 24)):
+        key = (filename, tuple(sprite_size))
+        sheet = self.sheets.get(key)
+        if sheet is None:
+            sheet = SpriteSheet(filename, sprite_size)
+            self.sheets[key] = sheet
+        return sheet
+
+    def invalidate(self, filename=None):
+        """
+        Drops cached assets; all of them when no filename is given.  The
+        asset cache is closed too, so the next load re-checks its sources
+        and rebuilds it if any changed.
+        """
+        asset_cache.invalidate()
+        if filename is None:
+            self.sheets.clear()
+            self.atlas = None
+            resource_index(rebuild=True)
+        else:
+            for key in [k for k in self.sheets if k[0] == filename]:
+                del self.sheets[key]
+            if filename in ANIMATIONS:
+                self.atlas = None
+
+    def animation_atlas(self):
+        """
+        The compiled animation atlas; read from the asset cache when it
+        has one, otherwise compiled from the .pxa folders.
+        """
+        if self.atlas is None:
+            atlas = asset_cache.atlas()
+            if atlas is None:
+                atlas = AnimationAtlas.compile()
+            self.atlas = atlas.convert()
+        return self.atlas
+
+assets = AssetRegistry()
+
+
+# Pixen animation folders packed into the animation atlas
+ANIMATIONS = [
+    'player_north_walk',
+    'player_south_walk',
+    'player_east_walk',
+    'player_west_walk',
+]
+# Cel durations are relative; one unit of duration lasts this many ticks
+ANIMATION_TICKS_PER_UNIT = 6
+
+
+class Animation(object):
+    """
+    A looping animation cut from the atlas.
+
+    The cels are display-format copies cut from the atlas once, through
+    prepare_surface, and the durations are expanded into a table holding
+    the cel to show on every tick of the loop, so playing it is one index
+    into that table.
+    """
+
+    def __init__(self, frames, durations, ticks_per_unit=ANIMATION_TICKS_PER_UNIT):
+        self.frames = frames
+        self.durations = durations
+        self.table = []
+        for frame, duration in zip(frames, durations):
+            self.table.extend([frame] * max(1, int(round(duration * ticks_per_unit))))
+        self.length = len(self.table)
+
+    def frame(self, tick):
+        return self.table[tick % self.length]
+
+
+class AnimationAtlas(object):
+    """
+    Every animation packed into one surface, a row per animation and a
+    column per cel, plus an index of name -> [(rect, duration), ...].
+    """
+
+    def __init__(self, surface, index):
+        self.surface = surface
+        self.index = index
+        self.animations = {}
+
+    @classmethod
+    def compile(cls, names=None):
+        """
+        Reads the named .pxa folders and packs their cels into a new atlas.
+        """
+        paths = resource_index()
+        rows = [
+            (name, read_pxa(paths[name]))
+            for name in (ANIMATIONS if names is None else names)
+            if name in paths
+        ]
+        width = max([sum(image.get_width() for image, _ in cels) for _, cels in rows] or [1])
+        height = sum(max([image.get_height() for image, _ in cels] or [0]) for _, cels in rows)
+        surface = pg.Surface((width, max(height, 1)), pg.SRCALPHA)
+        index = {}
+        y = 0
+        for name, cels in rows:
+            x = 0
+            index[name] = []
+            for image, duration in cels:
+                surface.blit(image, (x, y))
+                index[name].append((pg.Rect((x, y), image.get_size()), duration))
+                x += image.get_width()
+            y += max([image.get_height() for image, _ in cels] or [0])
+        return cls(surface, index)
+
+    def dump_index(self):
+        return dict(
+            (name, [list(rect) + [duration] for rect, duration in cels])
+            for name, cels in self.index.items()
+        )
+
+    @staticmethod
+    def load_index(data):
+        return dict(
+            (name, [(pg.Rect(cel[:4]), cel[4]) for cel in cels])
+            for name, cels in data.items()
+        )
+
+    def convert(self):
+        """
+        Converts the atlas for fast blitting once a display is up.
+        """
+        if pg.display.get_surface() is not None:
+            self.surface = self.surface.convert_alpha()
+            self.animations = {}
+        return self
+
+    def animation(self, name):
+        """
+        The named Animation, or None when the atlas does not have it.
+        """
+        animation = self.animations.get(name)
+        if animation is None:
+            cels = self.index.get(name)
+            if not cels:
+                return None
+            animation = Animation(
+                [prepare_surface(self.surface.subsurface(rect).copy()) for rect, _ in cels],
+                [duration for _, duration in cels],
+            )
+            self.animations[name] = animation
+        return animation
+
+
+class SpatialGrid(object):
+    """
+    Uniform grid broad-phase for rect based entities.
+
+    Each entity is bucketed once, by the cell holding the top-left corner of
+    its rect, so a rebuild is a single dict append per entity.  Queries widen
+    their search by the largest entity size seen so that entities hanging
+    over a cell border are still found.
+    """
+
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.max_w = 0
+        self.max_h = 0
+        self.count = 0
+
+    def clear(self):
+        self.cells.clear()
+        self.max_w = 0
+        self.max_h = 0
+        self.count = 0
+
+    def insert(self, entity):
+        rect = entity.rect
+        size = self.cell_size
+        key = (rect.x // size, rect.y // size)
+        bucket = self.cells.get(key)
+        if bucket is None:
+            self.cells[key] = [entity]
+        else:
+            bucket.append(entity)
+        if rect.w > self.max_w:
+            self.max_w = rect.w
+        if rect.h > self.max_h:
+            self.max_h = rect.h
+        self.count += 1
+
+    def rebuild(self, entities):
+        """
+        Rebuilds the grid from scratch; meant to be called once per frame.
+        """
+        cells = {}
+        size = self.cell_size
+        max_w = max_h = 0
+        count = 0
+        for entity in entities:
+            rect = entity.rect
+            key = (rect.x // size, rect.y // size)
+            bucket = cells.get(key)
+            if bucket is None:
+                cells[key] = [entity]
+            else:
+                bucket.append(entity)
+            if rect.w > max_w:
+                max_w = rect.w
+            if rect.h > max_h:
+                max_h = rect.h
+            count += 1
+        self.cells = cells
+        self.max_w = max_w
+        self.max_h = max_h
+        self.count = count
+
+    def _candidates(self, left, top, right, bottom):
+        size = self.cell_size
+        cells = self.cells
+        x0 = (left - self.max_w) // size
+        y0 = (top - self.max_h) // size
+        x1 = right // size
+        y1 = bottom // size
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = cells.get((cx, cy))
+                if bucket is not None:
+                    for entity in bucket:
+                        yield entity
+
+    def query_rect(self, rect):
+        """
+        Returns the entities whose rect overlaps the given rect.
+        """
+        rect = pg.Rect(rect)
+        return [
+            entity
+            for entity in self._candidates(rect.left, rect.top, rect.right, rect.bottom)
+            if rect.colliderect(entity.rect)
+        ]
+
+    def query_radius(self, center, radius):
+        """
+        Returns the entities whose rect center lies within radius of center.
+        """
+        x, y = center
+        radius_sq = radius * radius
+        found = []
+        candidates = self._candidates(int(x - radius), int(y - radius),
+                                      int(x + radius), int(y + radius))
+        for entity in candidates:
+            ex, ey = entity.rect.center
+            if (ex - x) ** 2 + (ey - y) ** 2 <= radius_sq:
+                found.append(entity)
+        return found
+
+    def query_segment(self, x0, y0, x1, y1):
+        """
+        Returns the entities whose rect the segment from (x0, y0) to
+        (x1, y1) passes through, nearest to (x0, y0) first.
+        """
+        # called once per bullet per tick, so the cell walk is inlined
+        size = self.cell_size
+        cells = self.cells
+        if x0 < x1:
+            cx0, cx1 = (x0 - self.max_w) // size, x1 // size
+        else:
+            cx0, cx1 = (x1 - self.max_w) // size, x0 // size
+        if y0 < y1:
+            cy0, cy1 = (y0 - self.max_h) // size, y1 // size
+        else:
+            cy0, cy1 = (y1 - self.max_h) // size, y0 // size
+        hits = []
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                bucket = cells.get((cx, cy))
+                if bucket is None:
+                    continue
+                for entity in bucket:
+                    clipped = entity.rect.clipline(x0, y0, x1, y1)
+                    if clipped:
+                        (hx, hy), _ = clipped
+                        hits.append(((hx - x0) ** 2 + (hy - y0) ** 2, entity))
+        if len(hits) > 1:
+            hits.sort(key=lambda hit: hit[0])
+        return [entity for _, entity in hits]
+
+
+class InputStage(object):
+    """
+    The one place the SDL event queue gets pumped each frame.
+
+    install limits the queue to the event types the game handles, so
+    mouse motion and the like never reach Python.
+    """
+
+    EVENT_TYPES = [pg.QUIT, pg.KEYDOWN, pg.KEYUP]
+
+    # The window needs repainting after these
+    EXPOSE_TYPES = [
+        getattr(pg, name)
+        for name in ('VIDEOEXPOSE', 'WINDOWEXPOSED')
+        if hasattr(pg, name)
+    ]
+
+    def __init__(self, event_types=None):
+        if event_types is None:
+            event_types = self.EVENT_TYPES + self.EXPOSE_TYPES
+        self.event_types = list(event_types)
+
+    def install(self):
+        pg.event.set_blocked(None)
+        pg.event.set_allowed(self.event_types)
+
+    def poll(self):
+        return pg.event.get()
+
+
+# Replay files are a magic header followed by fixed size records of
+# (kind, tick, value).
+REPLAY_MAGIC = b'FLEEREC\x01'
+REPLAY_GAME = 0     # value: seed the game was started with
+REPLAY_KEYDOWN = 1  # value: key
+REPLAY_KEYUP = 2    # value: key
+REPLAY_END = 3      # value: final score; tick: ticks played
+replay_record = struct.Struct('<BIq')
+
+
+class InputRecorder(object):
+    """
+    Writes each game's seed and the key events fed to the player, tagged
+    with the tick they were applied before, to a replay file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stream = open(path, 'wb')
+        self.stream.write(REPLAY_MAGIC)
+
+    def write(self, kind, tick, value):
+        self.stream.write(replay_record.pack(kind, tick, value))
+
+    def start_game(self, seed):
+        self.write(REPLAY_GAME, 0, seed)
+
+    def event(self, tick, event):
+        kind = REPLAY_KEYDOWN if event.type == KEY_PRESSED else REPLAY_KEYUP
+        self.write(kind, tick, event.key)
+
+    def end_game(self, tick, score):
+        self.write(REPLAY_END, tick, score)
+        self.stream.flush()
+
+    def close(self):
+        self.stream.close()
+
+
+class Playback(object):
+    """
+    One recorded game: its seed, its key events grouped by tick and how it
+    ended.
+    """
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.events = {}
+        self.end_tick = None
+        self.score = None
+
+    def add(self, tick, event):
+        self.events.setdefault(tick, []).append(event)
+
+
+def load_replay(path):
+    """
+    Reads a replay file into a list of Playback objects.
+    """
+    with open(path, 'rb') as stream:
+        data = stream.read()
+    if not data.startswith(REPLAY_MAGIC):
+        raise ValueError('%s is not a flee replay file' % path)
+    games = []
+    playback = None
+    event_types = {REPLAY_KEYDOWN: KEY_PRESSED, REPLAY_KEYUP: KEY_RELEASED}
+    offset = len(REPLAY_MAGIC)
+    size = replay_record.size
+    while offset + size <= len(data):
+        kind, tick, value = replay_record.unpack_from(data, offset)
+        offset += size
+        if kind == REPLAY_GAME:
+            playback = Playback(value)
+            games.append(playback)
+        elif playback is None:
+            raise ValueError('%s: record before the first game' % path)
+        elif kind in event_types:
+            playback.add(tick, pg.event.Event(event_types[kind], key=value, mod=0))
+        elif kind == REPLAY_END:
+            playback.end_tick = tick
+            playback.score = value
+    return games
+
+
+class FlowField(object):
+    """
+    Breadth-first distance map from the player over a navigation grid.
+
+    The field is rebuilt only when the target moves to another cell (or the
+    obstacles change); every zombie then reads its step direction from the
+    cell it stands in with a single lookup.  Moves are 8-way and, like the
+    zombies themselves, a diagonal step costs the same as a straight one.
+    Cells without a way forward (the target's own cell, unreachable cells)
+    hold (0, 0) so callers can fall back to heading straight at the target.
+
+    Cells grow past cell_size as needed to keep the grid within max_cells,
+    so a big scrolling world gets a coarser field rather than one that
+    takes tens of milliseconds to rebuild every few ticks.
+    """
+
+    NEIGHBOURS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
+    def __init__(self, area, cell_size=24, blocked=(), max_cells=1024):
+        self.area = pg.Rect(area)
+        if max_cells:
+            cell_size = max(cell_size, int(math.ceil(math.sqrt(self.area.w * self.area.h / float(max_cells)))))
+        self.cell_size = cell_size
+        self.cols = int(math.ceil(self.area.w / float(cell_size)))
+        self.rows = int(math.ceil(self.area.h / float(cell_size)))
+        self.blocked = set(blocked)
+        self.target = None
+        self.dirty = True
+        self.links = None
+        self.distances = []
+        self.directions = [(0, 0)] * (self.cols * self.rows)
+        self.arrays = None
+
+    def cell(self, x, y):
+        cell_size = self.cell_size
+        cx = min(max(int(x - self.area.x) // cell_size, 0), self.cols - 1)
+        cy = min(max(int(y - self.area.y) // cell_size, 0), self.rows - 1)
+        return cx, cy
+
+    def block(self, cell):
+        self.blocked.add(cell)
+        self.links = None
+        self.dirty = True
+
+    def unblock(self, cell):
+        self.blocked.discard(cell)
+        self.links = None
+        self.dirty = True
+
+    def update(self, point):
+        """
+        Re-targets the field on point; returns True if it was rebuilt.
+        """
+        target = self.cell(*point)
+        if target == self.target and not self.dirty:
+            return False
+        self.target = target
+        self.dirty = False
+        self.rebuild()
+        return True
+
+    def link(self):
+        """
+        Builds, for every open cell, the list of cells it can step to.
+        Only needs redoing when obstacles change.
+        """
+        cols, rows = self.cols, self.rows
+        blocked = self.blocked
+        links = [()] * (cols * rows)
+        for y in range(rows):
+            for x in range(cols):
+                if (x, y) in blocked:
+                    continue
+                cell_links = []
+                for dx, dy in self.NEIGHBOURS:
+                    nx, ny = x + dx, y + dy
+                    if not (0 <= nx < cols and 0 <= ny < rows):
+                        continue
+                    if (nx, ny) in blocked:
+                        continue
+                    # no cutting corners around obstacles
+                    if dx and dy and ((nx, y) in blocked or (x, ny) in blocked):
+                        continue
+                    cell_links.append((ny * cols + nx, nx, ny, (dx, dy)))
+                links[y * cols + x] = tuple(cell_links)
+        self.links = links
+
+    def rebuild(self):
+        if self.links is None:
+            self.link()
+        links = self.links
+        cols = self.cols
+        unreached = len(links)
+        distances = [unreached] * unreached
+        tx, ty = self.target
+        start = ty * cols + tx
+        distances[start] = 0
+        frontier = collections.deque([start])
+        while frontier:
+            index = frontier.popleft()
+            step = distances[index] + 1
+            for other, _, _, _ in links[index]:
+                if distances[other] > step:
+                    distances[other] = step
+                    frontier.append(other)
+
+        # Point each cell at its closest neighbour, breaking ties toward the
+        # straight line to the target so the horde doesn't zig-zag.
+        directions = [(0, 0)] * unreached
+        for index, here in enumerate(distances):
+            if here == 0 or here == unreached:
+                continue
+            closer = here - 1
+            best = None
+            best_offset = None
+            for other, nx, ny, step in links[index]:
+                if distances[other] == closer:
+                    offset = (tx - nx) ** 2 + (ty - ny) ** 2
+                    if best is None or offset < best_offset:
+                        best = step
+                        best_offset = offset
+            directions[index] = best
+        self.distances = distances
+        self.directions = directions
+        self.arrays = None
+
+    def direction(self, x, y):
+        """
+        Returns the (dx, dy) step for the cell holding point (x, y).
+        """
+        cell_size = self.cell_size
+        cx = int(x - self.area.x) // cell_size
+        cy = int(y - self.area.y) // cell_size
+        return self.directions[cy * self.cols + cx]
+
+    def as_arrays(self):
+        """
+        The direction table as two (rows, cols) NumPy arrays.
+        """
+        if self.arrays is None:
+            table = np.array(self.directions, dtype=np.int32).reshape(self.rows, self.cols, 2)
+            self.arrays = (table[:, :, 0].copy(), table[:, :, 1].copy())
+        return self.arrays
+
+
+class FrameTimer(object):
+    """
+    Accumulates wall-clock time per named phase of a frame.
+
+    Call begin at the top of a frame, mark after each phase and end once the
+    frame is done.  Finished frames are kept as dicts of phase -> seconds,
+    with the whole frame under 'frame'.
+    """
+
+    def __init__(self, history=None):
+        self.frames = collections.deque(maxlen=history)
+        self.current = None
+        self.start = self.last = 0.0
+
+    def begin(self):
+        self.current = {}
+        self.start = self.last = perf_counter()
+
+    def mark(self, phase):
+        now = perf_counter()
+        current = self.current
+        current[phase] = current.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def end(self):
+        frame = self.current
+        frame['frame'] = perf_counter() - self.start
+        self.frames.append(frame)
+        self.current = None
+        return frame
+
+    def phases(self):
+        names = []
+        for frame in self.frames:
+            for name in frame:
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def summary(self):
+        """
+        Returns {phase: {mean, p50, p99, max}} in milliseconds.
+        """
+        stats = {}
+        for name in self.phases():
+            samples = sorted(frame.get(name, 0.0) * 1000.0 for frame in self.frames)
+            stats[name] = {
+                'mean': sum(samples) / len(samples),
+                'p50': percentile(samples, 50),
+                'p99': percentile(samples, 99),
+                'max': samples[-1],
+            }
+        return stats
+
+
+class StartupReport(object):
+    """
+    Wall-clock breakdown of a cold start, from the first line of the import
+    through to the first frame.  The import phase is filled in from the
+    module's own timestamps; mark adds each later phase as it finishes.
+    """
+
+    def __init__(self):
+        self.phases = [('import', import_finished - import_started)]
+        self.last = perf_counter()
+
+    def mark(self, phase):
+        now = perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def total(self):
+        return sum(seconds for _, seconds in self.phases)
+
+    def format(self):
+        parts = ['%s %.1f ms' % (name, seconds * 1000.0) for name, seconds in self.phases]
+        return 'startup: %s  total %.1f ms' % ('  '.join(parts), self.total() * 1000.0)
+
+
+class RollingProfile(object):
+    """
+    Keeps a cProfile capture of roughly the last few seconds.
+
+    Profiling runs in short segments; finished segments are kept in a
+    bounded queue and merged when a dump is requested.
+    """
+
+    def __init__(self, seconds=10, segment=1.0):
+        self.segment = segment
+        self.segments = collections.deque(maxlen=max(1, int(math.ceil(seconds / segment))))
+        self.profiler = None
+        self.started = 0.0
+
+    def start(self):
+        import cProfile
+
+        self.profiler = cProfile.Profile()
+        self.started = perf_counter()
+        self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.segments.append(self.profiler)
+            self.profiler = None
+
+    def tick(self):
+        """
+        Rolls over to a new segment once the current one is old enough.
+        """
+        if self.profiler is None:
+            return
+        if perf_counter() - self.started >= self.segment:
+            self.stop()
+            self.start()
+
+    def dump(self, path):
+        """
+        Writes the merged capture to path as a pstats file.
+        """
+        running = self.profiler is not None
+        self.stop()
+        stats = None
+        if self.segments:
+            import pstats
+
+            stats = pstats.Stats(*self.segments)
+            stats.dump_stats(path)
+        if running:
+            self.start()
+        return stats
+
+
+class ProfilerOverlay(object):
+    """
+    Draws a rolling frame-time graph and per-phase averages from a
+    FrameTimer.  Bars over the frame budget are drawn red.
+    """
+
+    PHASES = ['events', 'spawn', 'player', 'zombies', 'bullets', 'text', 'blit', 'display']
+
+    def __init__(self, timer, font, size=(240, 60), budget=1000.0 / 60, refresh=30):
+        self.timer = timer
+        self.font = font
+        self.budget = budget
+        self.refresh = refresh
+        self.graph = pg.Surface(size)
+        if pg.display.get_surface() is not None:
+            self.graph = self.graph.convert()
+        self.bar_width = 2
+        self.lines = []
+        self.countdown = 0
+        self.visible = True
+
+    def render_lines(self, frames):
+        lines = []
+        if frames:
+            count = float(len(frames))
+            total = sum(frame['frame'] for frame in frames) * 1000.0 / count
+            lines.append("frame %6.2f ms" % total)
+            for phase in self.PHASES:
+                ms = sum(frame.get(phase, 0.0) for frame in frames) * 1000.0 / count
+                lines.append("%-8s %6.2f ms" % (phase, ms))
+        self.lines = [self.font.render(line, 1, (127, 255, 127)) for line in lines]
+
+    def draw(self, surface, dest):
+        if not self.visible:
+            return
+        graph = self.graph
+        w, h = graph.get_size()
+        frames = list(self.timer.frames)[-(w // self.bar_width):]
+        scale = h / (2.0 * self.budget)
+        graph.fill((0, 0, 0))
+        for index, frame in enumerate(frames):
+            ms = frame['frame'] * 1000.0
+            bar_height = min(h, int(ms * scale))
+            color = (127, 255, 127) if ms <= self.budget else (255, 63, 63)
+            graph.fill(color, (index * self.bar_width, h - bar_height, self.bar_width, bar_height))
+        graph.fill((255, 255, 127), (0, h - int(self.budget * scale), w, 1))
+        if self.countdown <= 0:
+            self.render_lines(frames)
+            self.countdown = self.refresh
+        self.countdown -= 1
+        x, y = dest
+        surface.blit(graph, (x, y))
+        y += h + 4
+        for line in self.lines:
+            surface.blit(line, (x, y))
+            y += line.get_height()
+
+
+class GlyphAtlas(object):
+    """
+    Pre-rendered glyphs for the characters a number can be made of.
+    """
+
+    CHARACTERS = '0123456789-'
+
+    def __init__(self, font, color, characters=CHARACTERS, antialias=1):
+        self.font = font
+        self.color = color
+        self.antialias = antialias
+        self.glyphs = dict(
+            (char, prepare_surface(font.render(char, antialias, color)))
+            for char in characters
+        )
+        self.height = max(glyph.get_height() for glyph in self.glyphs.values())
+
+    def width(self, text):
+        glyphs = self.glyphs
+        return sum(glyphs[char].get_width() for char in text)
+
+    def compose(self, surface, text, dest):
+        """
+        Blits text glyph by glyph onto surface; returns the x after it.
+        """
+        x, y = dest
+        glyphs = self.glyphs
+        for char in text:
+            glyph = glyphs[char]
+            surface.blit(glyph, (x, y))
+            x += glyph.get_width()
+        return x
+
+
+class HudLabel(object):
+    """
+    A "prefix: number" label that only re-composes when its value changes.
+
+    The prefix is rasterized once; numbers are put together from a
+    GlyphAtlas, so no text is rendered by the font while playing.  They
+    are composed into one canvas that is only reallocated when a longer
+    number no longer fits, and set hands out the used part of it.
+    """
+
+    def __init__(self, atlas, prefix):
+        self.atlas = atlas
+        self.prefix = prepare_surface(atlas.font.render(prefix, atlas.antialias, atlas.color))
+        self.value = None
+        self.canvas = None
+        # subsurfaces of the canvas by width, made once each
+        self.views = {}
+        self.surface = None
+
+    def set(self, value):
+        if value == self.value and self.surface is not None:
+            return self.surface
+        self.value = value
+        text = str(value)
+        prefix = self.prefix
+        width = prefix.get_width() + self.atlas.width(text)
+        height = max(prefix.get_height(), self.atlas.height)
+        canvas = self.canvas
+        if canvas is None or canvas.get_width() < width:
+            canvas = pg.Surface((width, height), pg.SRCALPHA)
+            if pg.display.get_surface() is not None:
+                # recomposed every time the value changes, so converted
+                # but not RLE encoded
+                canvas = canvas.convert_alpha()
+            canvas.blit(prefix, (0, 0))
+            self.canvas = canvas
+            self.views = {}
+        number = pg.Rect(prefix.get_width(), 0, width - prefix.get_width(), height)
+        canvas.fill((0, 0, 0, 0), number)
+        self.atlas.compose(canvas, text, number.topleft)
+        view = self.views.get(width)
+        if view is None:
+            view = self.views[width] = canvas.subsurface((0, 0, width, height))
+        self.surface = view
+        return view
+
+
+# Asset cache file: magic, (version, index length), a JSON index, then the
+# raw RGBA pixels of every entry.
+ASSET_CACHE_VERSION = 2
+ASSET_CACHE_MAGIC = b'FLEEASSETS'
+asset_cache_header = struct.Struct('<II')
+
+HUD_FONT = 'Tahoma'
+HUD_COLOR = (255, 255, 127)
+CACHED_IMAGES = ['player', 'zombie']
+CACHED_TEXT = [
+    (15, list(GlyphAtlas.CHARACTERS) + ['Score: ', 'Zombies: ']),
+    (45, ['GAME OVER']),
+]
+
+def text_key(font, size, color, text):
+    return 'text:%s/%d/%02x%02x%02x/%s' % ((font, size) + tuple(color[:3]) + (text,))
+
+
+class AssetCache(object):
+    """
+    Decoded images and pre-rendered HUD text, kept in one versioned file.
+
+    The file records the mtime, size and hash of every source asset it was
+    built from.  Opening it checks them and rebuilds the file when anything
+    changed; otherwise it is memory-mapped and surfaces are made straight
+    from the mapped pixels, with no PNG decoding or font rasterizing.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(game_path, '.cache', 'assets.v%d.bin' % ASSET_CACHE_VERSION)
+        self.path = path
+        self.entries = None
+        self.data = None
+        self.data_start = 0
+        self.converted = {}
+        self.touched = []
+
+    @staticmethod
+    def fingerprint(path, digest=True):
+        """
+        mtime, size and (unless digest is False) sha1 of a source asset.
+        """
+        if os.path.isdir(path):
+            # a folder source, like a .pxa animation, covers all its files
+            paths = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        else:
+            paths = [path]
+        sha1 = None
+        if digest:
+            import hashlib
+
+            sha1 = hashlib.sha1()
+        mtime = size = 0
+        for fpath in paths:
+            stat = os.stat(fpath)
+            mtime = max(mtime, stat.st_mtime)
+            size += stat.st_size
+            if sha1 is not None:
+                with open(fpath, 'rb') as stream:
+                    sha1.update(stream.read())
+        fingerprint = {'mtime': mtime, 'size': size}
+        if sha1 is not None:
+            fingerprint['sha1'] = sha1.hexdigest()
+        return fingerprint
+
+    def source_names(self):
+        index = resource_index()
+        return [name for name in CACHED_IMAGES + ANIMATIONS + [HUD_FONT] if name in index]
+
+    def sources(self):
+        index = resource_index()
+        return dict((name, self.fingerprint(index[name])) for name in self.source_names())
+
+    def up_to_date(self, recorded):
+        """
+        Whether the sources recorded in the cache still match the files.
+        Only stats them; a file is hashed only when its mtime or size
+        moved, so an ordinary start reads none of the source assets.
+
+        A file that was only touched keeps its hash; its new mtime and size
+        go into recorded and its name into touched, so load can write them
+        back and the hash is paid once.
+        """
+        self.touched = []
+        names = self.source_names()
+        if not recorded or sorted(recorded) != sorted(names):
+            return False
+        index = resource_index()
+        for name in names:
+            old = recorded[name]
+            new = self.fingerprint(index[name], digest=False)
+            if (new['mtime'], new['size']) != (old['mtime'], old['size']):
+                new = self.fingerprint(index[name])
+                if new['sha1'] != old['sha1']:
+                    return False
+                recorded[name] = new
+                self.touched.append(name)
+        return True
+
+    def open(self):
+        """
+        Loads the cache, rebuilding it first if it is missing or stale.
+        Falls back to an empty cache if it cannot be written.
+        """
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if self.load():
+            return
+        try:
+            self.build()
+        except (IOError, OSError, pg.error) as error:
+            logging.warning('Asset cache unavailable: %s', error)
+            return
+        self.load()
+
+    def load(self):
+        try:
+            stream = open(self.path, 'rb')
+        except (IOError, OSError):
+            return False
+        with stream:
+            magic = stream.read(len(ASSET_CACHE_MAGIC))
+            header = stream.read(asset_cache_header.size)
+            if magic != ASSET_CACHE_MAGIC or len(header) != asset_cache_header.size:
+                return False
+            version, index_length = asset_cache_header.unpack(header)
+            if version != ASSET_CACHE_VERSION:
+                return False
+            try:
+                index = json.loads(stream.read(index_length).decode('utf-8'))
+            except ValueError:
+                return False
+            if not self.up_to_date(index.get('sources')):
+                return False
+            data_start = len(ASSET_CACHE_MAGIC) + asset_cache_header.size + index_length
+            entries = index['entries']
+            # a file cut short is as stale as a missing one
+            data_end = max([entry['offset'] + entry['length'] for entry in entries.values()] or [0])
+            if os.fstat(stream.fileno()).st_size < data_start + data_end:
+                return False
+            try:
+                self.data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return False
+        if self.touched:
+            # record the touched files' new stats, so the next start doesn't
+            # hash them again
+            try:
+                self.write(index['sources'], entries, [self.data[data_start:data_start + data_end]])
+            except (IOError, OSError) as error:
+                logging.warning('Asset cache not refreshed: %s', error)
+        self.data_start = data_start
+        self.entries = entries
+        self.converted = {}
+        return True
+
+    def build(self, sources=None):
+        """
+        Decodes and renders every cached asset and writes the file.
+        """
+        if sources is None:
+            sources = self.sources()
+        index = resource_index()
+        entries = {}
+        blobs = []
+        offset = [0]
+
+        def add(key, surface):
+            pixels = tobytes(surface, 'RGBA')
+            entries[key] = {
+                'offset': offset[0],
+                'length': len(pixels),
+                'size': list(surface.get_size()),
+            }
+            blobs.append(pixels)
+            offset[0] += len(pixels)
+
+        for name in CACHED_IMAGES:
+            if name in index:
+                add('image:%s' % name, pg.image.load(index[name]))
+        atlas = AnimationAtlas.compile()
+        add('atlas:animations', atlas.surface)
+        entries['atlas:animations']['index'] = atlas.dump_index()
+        pg.font.init()
+        for size, texts in CACHED_TEXT:
+            font = pg.font.Font(index.get(HUD_FONT), size)
+            for text in texts:
+                add(text_key(HUD_FONT, size, HUD_COLOR, text), font.render(text, 1, HUD_COLOR))
+
+        self.write(sources, entries, blobs)
+        return entries
+
+    def write(self, sources, entries, blobs):
+        """
+        Writes the file from its index and pixel blobs, atomically.
+        """
+        header = json.dumps({'sources': sources, 'entries': entries}, sort_keys=True).encode('utf-8')
+        folder = os.path.dirname(self.path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # another process made it first
+                if not os.path.isdir(folder):
+                    raise
+        import tempfile
+
+        # every writer gets its own temp file, so processes building a cold
+        # cache at once (batch.py workers) never write into each other's
+        handle, temp = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.', suffix='.tmp', dir=folder)
+        try:
+            with os.fdopen(handle, 'wb') as stream:
+                stream.write(ASSET_CACHE_MAGIC)
+                stream.write(asset_cache_header.pack(ASSET_CACHE_VERSION, len(header)))
+                stream.write(header)
+                for blob in blobs:
+                    stream.write(blob)
+            # mkstemp makes the file private; give it the mode any other
+            # file would get so other users can share the cache
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp, 0o666 & ~umask)
+            # replace rather than rewrite; an old mapping stays valid
+            getattr(os, 'replace', os.rename)(temp, self.path)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+    def invalidate(self):
+        self.entries = None
+        self.data = None
+        self.converted = {}
+
+    def surface(self, key):
+        self.open()
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        start = self.data_start + entry['offset']
+        pixels = memoryview(self.data)[start:start + entry['length']]
+        return pg.image.frombuffer(pixels, tuple(entry['size']), 'RGBA')
+
+    def image(self, name):
+        """
+        The decoded (not yet display-converted) image, or None.
+        """
+        return self.surface('image:%s' % name)
+
+    def atlas(self):
+        """
+        The cached animation atlas (not yet display-converted), or None.
+        """
+        surface = self.surface('atlas:animations')
+        if surface is None:
+            return None
+        return AnimationAtlas(surface, AnimationAtlas.load_index(self.entries['atlas:animations']['index']))
+
+    def text(self, font, size, color, text):
+        key = text_key(font, size, color, text)
+        surface = self.converted.get(key)
+        if surface is None:
+            surface = self.surface(key)
+            if surface is None:
+                return None
+            surface = prepare_surface(surface)
+            self.converted[key] = surface
+        return surface
+
+    def font(self, name, size):
+        return CachedFont(self, name, size)
+
+asset_cache = AssetCache()
+
+
+class CachedFont(object):
+    """
+    Font-like front for the asset cache: text that was pre-rendered comes
+    out of the cache; anything else goes to the real font, which is only
+    loaded the first time it is needed.
+    """
+
+    def __init__(self, cache, name, size):
+        self.cache = cache
+        self.name = name
+        self.size = size
+        self._font = None
+
+    @property
+    def font(self):
+        if self._font is None:
+            pg.font.init()
+            self._font = pg.font.Font(resource_index().get(self.name), self.size)
+        return self._font
+
+    def render(self, text, antialias, color, background=None):
+        if antialias and background is None:
+            surface = self.cache.text(self.name, self.size, color, text)
+            if surface is not None:
+                return surface
+        return self.font.render(text, antialias, color, background)
+
+
+class AssetLoader(object):
+    """
+    Loads assets on a worker thread so the main thread can keep a loading
+    screen up.
+
+    jobs is a list of (name, function) pairs, run in order; each return
+    value is kept in results under its name and each run time in timings.
+    progress and current can be read from the main thread at any time;
+    wait re-raises whatever a job raised.  stop skips the jobs not yet
+    started and waits out the one running, so nothing is left touching
+    pygame when it shuts down.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = list(jobs)
+        self.results = {}
+        self.timings = []
+        self.current = None
+        self.error = None
+        self.thread = None
+        self.stopping = False
+
+    @property
+    def progress(self):
+        if not self.jobs:
+            return 1.0
+        return len(self.timings) / float(len(self.jobs))
+
+    @property
+    def done(self):
+        return self.thread is not None and not self.thread.is_alive()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='asset-loader')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def run(self):
+        for name, job in self.jobs:
+            if self.stopping:
+                break
+            self.current = name
+            started = perf_counter()
+            try:
+                self.results[name] = job()
+            except Exception as error:
+                self.error = error
+                break
+            self.timings.append((name, perf_counter() - started))
+        self.current = None
+
+    def wait(self):
+        """
+        Blocks until every job has run (running them here if the loader
+        was never started) and returns the results.
+        """
+        if self.thread is None:
+            self.run()
+        else:
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.results
+
+    def stop(self):
+        self.stopping = True
+        if self.thread is not None:
+            self.thread.join()
+
+    def report(self):
+        parts = ['%s %.1f ms' % (name, seconds * 1000.0) for name, seconds in self.timings]
+        return 'assets: %s' % '  '.join(parts)
+
+
+class DirtyRenderer(object):
+    """
+    Draws onto the display surface while tracking which regions changed.
+
+    Every rect drawn in a frame is remembered.  At the start of the next
+    frame only those regions are restored from the background, and only the
+    old and new regions are pushed to the display.  When the dirty area
+    gets past full_refresh_ratio of the screen, a plain full update is
+    cheaper and is used instead, and when a frame drew that much the next
+    one restores the whole background in one blit rather than rect by rect.
+
+    Exposes blit/blits like a Surface so entities can draw into it.
+    """
+
+    def __init__(self, surface, background, full_refresh_ratio=0.5):
+        self.surface = surface
+        self.background = background
+        # an object with restore(surface, rects) to paint instead of the
+        # background surface, e.g. the scrolling world's TileCache
+        self.backdrop = None
+        self.full_refresh_ratio = full_refresh_ratio
+        self.screen_rect = surface.get_rect()
+        self.previous = []
+        self.current = []
+        self.full = True
+
+    def invalidate(self):
+        """
+        Forces the next frame to repaint and push the whole screen.
+        """
+        self.full = True
+
+    def begin(self):
+        """
+        Restores the background wherever the previous frame drew.
+        """
+        if self.backdrop is not None:
+            self.backdrop.restore(self.surface, None if self.full else self.current)
+        elif self.full:
+            self.surface.blit(self.background, (0, 0))
+        else:
+            background = self.background
+            self.surface.blits(
+                [(background, rect, rect) for rect in self.current],
+                doreturn=False,
+            )
+        self.previous = self.current
+        self.current = []
+
+    def blit(self, source, dest, area=None, special_flags=0):
+        rect = self.surface.blit(source, dest, area, special_flags)
+        self.current.append(rect)
+        return rect
+
+    def blits(self, blit_sequence, doreturn=True):
+        rects = self.surface.blits(blit_sequence, doreturn=True)
+        self.current.extend(rects)
+        return rects if doreturn else None
+
+    def dirty_rects(self):
+        """
+        Returns the merged list of regions changed since the last frame, or
+        None when a full refresh is due.
+        """
+        if self.full:
+            return None
+        rects = self.previous + self.current
+        if self.covers(rects):
+            return None
+        merged = []
+        for rect in rects:
+            index = rect.collidelist(merged)
+            if index < 0:
+                merged.append(pg.Rect(rect))
+            else:
+                merged[index].union_ip(rect)
+        return merged
+
+    def covers(self, rects):
+        """
+        Whether rects add up to more than full_refresh_ratio of the screen.
+        """
+        limit = self.full_refresh_ratio * self.screen_rect.w * self.screen_rect.h
+        return sum(r.w * r.h for r in rects) > limit
+
+    def present(self):
+        rects = self.dirty_rects()
+        if rects is None:
+            pg.display.update()
+        else:
+            pg.display.update(rects)
+        # a frame that drew over most of the screen is cheaper to clear
+        # with one full restore than with a blit per rect
+        self.full = self.covers(self.current)
+
+
+# Draw order of the render queue's layers, back to front
+LAYER_ZOMBIES = 10
+LAYER_BULLETS = 20
+LAYER_PLAYER = 30
+LAYER_HUD = 100
+
+
+class RenderLayer(object):
+    """
+    One layer of a RenderQueue.  Takes blit/blits calls like a Surface
+    but only records them.
+    """
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.commands = []
+        self.sources = set()
+
+    def blit(self, source, dest, area=None, special_flags=0):
+        if area is None and not special_flags:
+            self.commands.append((source, dest))
+        else:
+            self.commands.append((source, dest, area, special_flags))
+        self.sources.add(source)
+
+    def blits(self, blit_sequence, doreturn=False):
+        if not isinstance(blit_sequence, list):
+            blit_sequence = list(blit_sequence)
+        if self.commands:
+            self.commands.extend(blit_sequence)
+        else:
+            # entities hand over freshly built lists; adopt rather than copy
+            self.commands = blit_sequence
+        self.sources.update([command[0] for command in blit_sequence])
+
+    def __len__(self):
+        return len(self.commands)
+
+
+class RenderQueue(object):
+    """
+    Collects a frame's draw commands from every entity and submits them
+    layer by layer, back to front.
+
+    Within a layer the commands are grouped by source surface (a stable
+    sort, so same-source commands keep their order) and sent in a single
+    blits call.  Layers are created on first use and kept between frames.
+    """
+
+    def __init__(self, check_formats=False):
+        self.layers = {}
+        self.order = []
+        # debug aid: warn about sources that aren't in display format
+        self.check_formats = check_formats
+        self.warned = set()
+
+    def check(self, sources):
+        for source in sources:
+            if id(source) not in self.warned and not matches_display(source):
+                self.warned.add(id(source))
+                logging.warning(
+                    'Blitting a %d-bit %dx%d surface that does not match the display '
+                    'format; pass it through prepare_surface first',
+                    source.get_bitsize(), source.get_width(), source.get_height(),
+                )
+
+    def layer(self, depth):
+        layer = self.layers.get(depth)
+        if layer is None:
+            layer = self.layers[depth] = RenderLayer(depth)
+            self.order = sorted(self.layers)
+        return layer
+
+    def flush(self, surface):
+        """
+        Draws everything queued onto surface and empties the queue.
+        """
+        for depth in self.order:
+            layer = self.layers[depth]
+            commands = layer.commands
+            if not commands:
+                continue
+            if self.check_formats:
+                self.check(layer.sources)
+            if len(layer.sources) > 1:
+                commands.sort(key=lambda command: id(command[0]))
+            surface.blits(commands, doreturn=False)
+            layer.commands = []
+            layer.sources.clear()
+
+
+class Camera(object):
+    """
+    The window's view onto a world larger than the screen.
+
+    follow centers the view on a point, clamped so it never shows past the
+    world's edges (a world smaller than the view is centered instead).
+    """
+
+    def __init__(self, view_size, world):
+        self.world = pg.Rect(world)
+        self.rect = pg.Rect((0, 0), view_size)
+
+    def follow(self, center):
+        """
+        Moves the view; returns True when it actually moved.
+        """
+        old = self.rect.topleft
+        self.rect.center = center
+        self.rect.clamp_ip(self.world)
+        return self.rect.topleft != old
+
+    def to_screen(self, pos):
+        return pos[0] - self.rect.x, pos[1] - self.rect.y
+
+
+class TileCache(object):
+    """
+    The ground of a scrolling world.
+
+    The world is a grid of tiles picked by a hash of their coordinates.
+    Tiles are pre-rendered in square chunks the first time a chunk comes
+    into view, and the chunks are kept in a least-recently-used cache, so
+    a scrolling frame is a handful of chunk blits however big the world.
+    """
+
+    COLORS = [(34, 40, 30), (38, 44, 32), (30, 36, 28), (42, 46, 36)]
+
+    def __init__(self, world, camera, tile_size=32, chunk_tiles=8, capacity=48):
+        self.world = pg.Rect(world)
+        self.camera = camera
+        self.tile_size = tile_size
+        self.chunk_size = tile_size * chunk_tiles
+        self.capacity = capacity
+        self.chunks = collections.OrderedDict()
+        self.rendered = 0
+        self.tiles = self.make_tiles()
+
+    def make_tiles(self):
+        """
+        Draws the tile set.  Uses its own generator so the game's seeded
+        random sequence is left alone.
+        """
+        rng = random.Random(len(self.COLORS))
+        size = self.tile_size
+        tiles = []
+        for color in self.COLORS:
+            tile = pg.Surface((size, size))
+            tile.fill(color)
+            speck = tuple(min(c + 14, 255) for c in color)
+            for _ in range(size // 4):
+                tile.fill(speck, (rng.randrange(size), rng.randrange(size), 2, 2))
+            if pg.display.get_surface() is not None:
+                tile = tile.convert()
+            tiles.append(tile)
+        return tiles
+
+    def tile_at(self, tx, ty):
+        return ((tx * 73856093) ^ (ty * 19349663)) % len(self.tiles)
+
+    def chunk(self, cx, cy):
+        """
+        The pre-rendered chunk at chunk coordinates (cx, cy).
+        """
+        key = (cx, cy)
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+            return chunk
+        chunk = pg.Surface((self.chunk_size, self.chunk_size))
+        if pg.display.get_surface() is not None:
+            chunk = chunk.convert()
+        size = self.tile_size
+        count = self.chunk_size // size
+        tiles = self.tiles
+        chunk.blits(
+            [(tiles[self.tile_at(cx * count + x, cy * count + y)], (x * size, y * size))
+             for x in range(count) for y in range(count)],
+            doreturn=False,
+        )
+        self.chunks[key] = chunk
+        self.rendered += 1
+        if len(self.chunks) > self.capacity:
+            self.chunks.popitem(last=False)
+        return chunk
+
+    def draw(self, surface, view, area=None):
+        """
+        Paints the ground seen through view onto surface; only the screen
+        region area when one is given.  Anything outside the world is
+        left black.
+        """
+        screen = pg.Rect(area) if area is not None else surface.get_rect()
+        region = screen.move(view.x, view.y)
+        inside = region.clip(self.world)
+        if inside.size != region.size:
+            surface.fill((0, 0, 0), screen)
+        if not inside.w or not inside.h:
+            return
+        size = self.chunk_size
+        blits = []
+        for cx in range(inside.left // size, (inside.right - 1) // size + 1):
+            for cy in range(inside.top // size, (inside.bottom - 1) // size + 1):
+                chunk_rect = pg.Rect(cx * size, cy * size, size, size)
+                part = chunk_rect.clip(inside)
+                blits.append((
+                    self.chunk(cx, cy),
+                    (part.x - view.x, part.y - view.y),
+                    part.move(-chunk_rect.x, -chunk_rect.y),
+                ))
+        surface.blits(blits, doreturn=False)
+
+    def restore(self, surface, rects=None):
+        """
+        DirtyRenderer backdrop hook: repaints the given screen rects, or the
+        whole screen when rects is None.
+        """
+        view = self.camera.rect
+        if rects is None:
+            self.draw(surface, view)
+        else:
+            for rect in rects:
+                self.draw(surface, view, rect)
+
+
 # ----------------------------------------------------------------------
 # Object Classes
 # ----------------------------------------------------------------------
 class PlayerDied(Exception):
     pass
 
-class Player(pg.sprite.Sprite):
+class Player(object):
 
     """
     Player
+
+    Uses __slots__ rather than a per-instance dict; every piece of state is
+    a plain attribute.
     """
+    __slots__ = (
+        'logger', 'sheet', 'image', 'rect', 'start_pos', 'prev_pos', 'area',
+        'key_actions', 'zombies', 'state', 'movepos', 'speed', 'orientation',
+        '_health', 'score', 'walk_cycles', 'walk_tick', 'bullets',
+    )
+
+    default_health = 3
+
     STATES = [
         "standing",
         "sneaking",
@@ -176,52 +1979,78 @@ class Player(pg.sprite.Sprite):
         "west",
     ]
 
+    # sprite sheet (column, row) for each facing
+    FACE_FRAMES = {
+        "north": (0, 3),
+        "east": (0, 1),
+        "south": (0, 2),
+        "west": (0, 0),
+    }
+
+    # direction a shot takes when standing still
+    FACE_VECTORS = {
+        "north": (0, -1),
+        "east": (1, 0),
+        "south": (0, 1),
+        "west": (-1, 0),
+    }
+
     @property
     def health(self):
-        attr = '__health__'
-        if not hasattr(self, attr):
-            setattr(self, attr, self.default_health)
-        return getattr(self, attr)
+        return self._health
 
     @health.setter
     def health(self, value=0):
-        attr = '__health__'
-        setattr(self, attr, value)
-        if self.health <= 0:
-            setattr(self, attr, 0)
+        if value <= 0:
+            self._health = 0
             logging.debug('Player is dead')
             raise PlayerDied()
-            self.setup()
-        else:
-            logging.debug('Player health = %s' % self.health)
+        self._health = value
+        logging.debug('Player health = %s', value)
 
-    def __init__(self, bullets, logger=None):
-        # super(Player, self).__init__()
-        pg.sprite.Sprite.__init__(self)
+    def __init__(self, bullets, logger=None, area=None):
         self.logger = logger if logger is not None else LoggerFacade()
-        self.sheet = SpriteSheet('player')
+        self.bullets = bullets
+        self.sheet = assets.sprite_sheet('player')
         self.image, self.rect = self.sheet[(0, 2)]
-        self.area = pg.display.get_surface().get_rect()
+        self.zombies = []
+        self.area = pg.Rect(area) if area is not None else pg.display.get_surface().get_rect()
+        if area is None:
+            self.start_pos = self.rect.topleft
+        else:
+            # a scrolling world starts the player in its middle
+            start = pg.Rect(self.rect)
+            start.center = self.area.center
+            self.start_pos = start.topleft
+        self.prev_pos = self.start_pos
+        atlas = assets.animation_atlas()
+        self.walk_cycles = dict(
+            (face, atlas.animation('player_%s_walk' % face))
+            for face in self.FACES
+        )
+        self.bind_key_actions()
         self.setup()
 
     def setup(self):
-        if not hasattr(self, 'zombies'):
-            self.zombies = []
-        else:
-            [self.zombies.pop() for z in self.zombies]
-            self.zombies.append(Zombie(self, logging))
-        self.image.get_rect().x = self.area.w/2.0
-        self.image.get_rect().y = self.area.h/2.0
+        """
+        Puts the player back in its starting state; called again when a
+        game restarts so the same Player can be reused.
+        """
+        self.rect.topleft = self.start_pos
+        self.prev_pos = self.start_pos
+        self.image = self.sheet.frame(*self.FACE_FRAMES["south"])
         self.state = "standing"
         self.movepos = [0, 0]
         self.speed = 10
         self.orientation = "south"
         self.state = "standing"
-        self.health = 3
+        self.walk_tick = 0
+        self.health = self.default_health
         self.score = 0
         # self.rect.center = self.movepos
 
     def update(self):
+        self.prev_pos = self.rect.topleft
         moving = False
         self.score += 0.1 * len(self.zombies)
         newpos = self.rect.move(self.movepos)
@@ -238,19 +2067,17 @@ class Player(pg.sprite.Sprite):
                 self.rect = newpos
         if moving is False:
             self.state = "standing"
-        if self.orientation == "north":
-            self.image, rect = self.sheet[(0, 3)]
-        elif self.orientation == "east":
-            self.image, rect = self.sheet[(0, 1)]
-        elif self.orientation == "south":
-            self.image, rect = self.sheet[(0, 2)]
-        elif self.orientation == "west":
-            self.image, rect = self.sheet[(0, 0)]
+        walk = self.walk_cycles.get(self.orientation)
+        if moving and walk is not None and (self.movepos[X_AXIS] or self.movepos[Y_AXIS]):
+            self.walk_tick += 1
+            self.image = walk.frame(self.walk_tick)
+        else:
+            self.walk_tick = 0
+            self.image = self.sheet.frame(*self.FACE_FRAMES[self.orientation])
         if self.movepos == (0, 0):
             self.state = "standing"
         elif self.state == "standing":
             self.state = "walking"
-        pg.event.pump()
 
     def move_north(self, event):
         if event.type == KEY_PRESSED:
@@ -321,8 +2148,7 @@ class Player(pg.sprite.Sprite):
                 self.movepos[X_AXIS] = 0
 
     def rotate_right(self, event):
-        move_event = 2
-        if event.type == move_event:
+        if event.type == KEY_PRESSED:
             if self.orientation == "north":
                 self.orientation = "east"
             elif self.orientation == "east":
@@ -333,8 +2159,7 @@ class Player(pg.sprite.Sprite):
                 self.orientation = "north"
 
     def rotate_left(self, event):
-        move_event = 2
-        if event.type == move_event:
+        if event.type == KEY_PRESSED:
             if self.orientation == "north":
                 self.orientation = "west"
             elif self.orientation == "west":
@@ -345,56 +2170,229 @@ class Player(pg.sprite.Sprite):
                 self.orientation = "north"
 
     def strafe_left(self, event):
-        move_event = 2
         facing = self.orientation
-        speed = self.speed if event.type == move_event else 0
+        speed = self.speed if event.type == KEY_PRESSED else 0
         speed = -speed if facing in ['south', 'west'] else speed
         pos_index = 0 if facing in ['north', 'south'] else 1
         # logging.debug("((%s) movepos[%s] += %s" % (event.type, pos_index, speed))
         self.movepos[pos_index] = speed
 
     def strafe_right(self, event):
-        move_event = 2
         facing = self.orientation
-        speed = self.speed if event.type == move_event else 0
+        speed = self.speed if event.type == KEY_PRESSED else 0
         speed = -speed if facing in ['north', 'east'] else speed
         pos_index = 0 if facing in ['north', 'south'] else 1
         # logging.debug("((%s) movepos[%s] += %s" % (event.type, pos_index, speed))
         self.movepos[pos_index] = speed
 
     def attack(self, event):
-        b = Bullet()
+        """
+        Fires a bullet from the player's center: along the way it is moving,
+        or the way it faces when standing still.
+        """
+        if event.type != KEY_PRESSED or self.bullets is None:
+            return
+        dx, dy = self.movepos
+        if not (dx or dy):
+            dx, dy = self.FACE_VECTORS[self.orientation]
+        self.bullets.fire(self.rect.centerx, self.rect.centery, dx, dy)
 
     def is_alive(self):
-        return self.health > 0
+        return self._health > 0
+
+    def bind_key_actions(self):
+        """
+        Resolves the key -> action table into this player's bound methods.
+        """
+        self.key_actions = dict(
+            (key, tuple(getattr(self, name) for name in names if hasattr(self, name)))
+            for key, names in key_actions.items()
+        )
 
     def handle_event(self, event):
-        if event.type in keyboard_events:
-            for func, keys in keyboard_controls.items():
-                if event.key in keys:
-                    if hasattr(self, func):
-                        func = getattr(self, func)
-                        func(event)
+        if event.type == KEY_PRESSED or event.type == KEY_RELEASED:
+            for action in self.key_actions.get(event.key, ()):
+                action(event)
+
+class Projectiles(object):
+    """
+    Every bullet in flight, in a fixed-capacity ring buffer.
+
+    Bullets live in parallel lists indexed by slot.  They all share one
+    lifetime, so they expire in the order they were fired: the live ones
+    always sit between tail and head, and firing into a full ring retires
+    the oldest.  A bullet that hits something is only flagged dead; the
+    tail skips over it once it reaches that slot.
+
+    Each tick moves every bullet in one pass and tests the whole path it
+    travelled against the horde, so a bullet that moves further than a
+    zombie is wide in one tick still can't skip over it.
+    """
+
+    def __init__(self, area, capacity=4096, speed=16, lifetime=60, damage=1,
+                 size=(4, 4), color=(255, 255, 127)):
+        self.area = area
+        self.capacity = capacity
+        self.speed = speed
+        self.lifetime = lifetime
+        self.damage = damage
+        self.x = [0.0] * capacity
+        self.y = [0.0] * capacity
+        self.vx = [0.0] * capacity
+        self.vy = [0.0] * capacity
+        self.fired = [0] * capacity
+        self.alive = [False] * capacity
+        self.head = 0    # slot the next bullet goes in
+        self.tail = 0    # oldest slot still in the ring
+        self.count = 0   # slots in use, tail to head
+        self.live = 0    # bullets still in flight
+        self.ticks = 0
+        self.image = pg.Surface(size)
+        self.offset = (size[0] // 2, size[1] // 2)
+        if pg.display.get_surface() is not None:
+            self.image = self.image.convert()
+        self.image.fill(color)
+
+    def __len__(self):
+        return self.live
+
+    def clear(self):
+        self.alive = [False] * self.capacity
+        self.head = self.tail = self.count = self.live = 0
+        self.ticks = 0
+
+    def fire(self, x, y, dx, dy):
+        """
+        Launches a bullet from (x, y) heading along (dx, dy).
+        """
+        length = math.sqrt(dx * dx + dy * dy)
+        if not length:
+            return
+        if self.count == self.capacity:
+            self._retire()
+        slot = self.head
+        self.x[slot] = float(x)
+        self.y[slot] = float(y)
+        self.vx[slot] = dx * self.speed / length
+        self.vy[slot] = dy * self.speed / length
+        self.fired[slot] = self.ticks
+        self.alive[slot] = True
+        self.head = (slot + 1) % self.capacity
+        self.count += 1
+        self.live += 1
+
+    def _retire(self):
+        tail = self.tail
+        if self.alive[tail]:
+            self.alive[tail] = False
+            self.live -= 1
+        self.tail = (tail + 1) % self.capacity
+        self.count -= 1
+
+    def slots(self):
+        """
+        The slots from tail to head, oldest first.
+        """
+        end = self.tail + self.count
+        if end <= self.capacity:
+            return range(self.tail, end)
+        return list(range(self.tail, self.capacity)) + list(range(end - self.capacity))
+
+    def update(self, horde):
+        """
+        Moves every bullet one tick and resolves what it hit.  Returns the
+        number of zombies killed.
+        """
+        self.ticks += 1
+        alive = self.alive
+        fired = self.fired
+        expired = self.ticks - self.lifetime
+        while self.count and (not alive[self.tail] or fired[self.tail] <= expired):
+            self._retire()
+        if not self.live:
+            return 0
+        horde.prepare_hits()
+        x = self.x
+        y = self.y
+        vx = self.vx
+        vy = self.vy
+        area = self.area
+        damage = self.damage
+        first_hit = horde.first_hit
+        for slot in self.slots():
+            if not alive[slot]:
+                continue
+            x0 = x[slot]
+            y0 = y[slot]
+            x1 = x[slot] = x0 + vx[slot]
+            y1 = y[slot] = y0 + vy[slot]
+            target = first_hit(int(x0), int(y0), int(x1), int(y1))
+            if target is not None:
+                horde.damage(target, damage)
+            elif area.collidepoint(x1, y1):
+                continue
+            alive[slot] = False
+            self.live -= 1
+        return horde.remove_dead()
+
+    def draw(self, surface, alpha=1.0, view=None):
+        """
+        Draws every live bullet, blended alpha of the way from where it was
+        last tick to where it is now.  With a view rect, only bullets inside
+        it are drawn, offset to the view.
+        """
+        if not self.live:
+            return
+        image = self.image
+        x = self.x
+        y = self.y
+        vx = self.vx
+        vy = self.vy
+        alive = self.alive
+        back = 1.0 - min(alpha, 1.0)
+        ox, oy = self.offset
+        slots = [slot for slot in self.slots() if alive[slot]]
+        if view is not None:
+            slots = [slot for slot in slots if view.collidepoint(x[slot], y[slot])]
+            ox += view.x
+            oy += view.y
+        surface.blits(
+            [(image, (int(x[slot] - vx[slot] * back) - ox, int(y[slot] - vy[slot] * back) - oy))
+             for slot in slots],
+            doreturn=False,
+        )
+
 
-class Bullet(object):
+class Zombie(object):
 
-    def __init__(self, point, vector, logger=None):
-        pass
+    """
+    Zombie
 
+    Slotted rather than a Sprite: zombies are never put in sprite groups
+    and a horde can hold tens of thousands of them.
+    """
+    __slots__ = (
+        'image', 'rect', 'area', 'player', 'speed', 'health', 'attack',
+        'movepos', 'prev_pos', 'slot', 'synced',
+    )
 
-class Zombie(pg.sprite.Sprite):
+    def __init__(self, player=None, logger=None):
+        self.image, self.rect = assets.sprite_sheet('zombie')[(0, 0)]
+        self.area = None
+        self.player = None
+        # pooled zombies are built without a player and reset when used
+        if player is not None:
+            self.reset(player)
 
-    def __init__(self, player, logger=None):
-        # super(Player, self).__init__()
-        pg.sprite.Sprite.__init__(self)
-        logging = logger if logger is not None else LoggerFacade()
-        self.sheet = SpriteSheet('zombie')
-        self.image, self.rect = self.sheet[(0, 0)]
-        self.area = pg.display.get_surface().get_rect()
+    def reset(self, player):
         self.speed = 2
         self.health = 1
         self.attack = 1
         self.player = player
+        # the AIScheduler tick this zombie's rect is current for
+        self.synced = 0
+        # zombies roam the same playfield as the player they hunt
+        self.area = player.area
         self.spawn()
 
     def spawn(self):
@@ -409,26 +2407,39 @@ class Zombie(pg.sprite.Sprite):
         y = 0 if y < (wy / 2.0) else wy - 24
         self.rect.x = x
         self.rect.y = y
+        self.prev_pos = self.rect.topleft
         self.movepos = [0, 0]
         # self.rect.center = self.movepos
 
-    def find_player(self):
-        xp = self.player.rect.x
-        yp = self.player.rect.y
-        xz = self.rect.x
-        yz = self.rect.y
-        dx = (xp - xz)
-        dy = (yp - yz)
-        if (dx == 0) and (dy == 0):
-            pass
-        else:
-            dx, dy = ((xp - xz)/math.sqrt((xp - xz) ** 2 + (yp - yz) ** 2),
-                      (yp - yz)/math.sqrt((xp - xz) ** 2 + (yp - yz) ** 2))
+    def find_player(self, flow=None):
+        """
+        Returns the direction to step in: the flow field's, when one is
+        given and has a way forward here, otherwise straight at the player.
+        """
+        rect = self.rect
+        if flow is not None:
+            step = flow.direction(rect.centerx, rect.centery)
+            if step[0] or step[1]:
+                return step
+        target = self.player.rect
+        dx = target.x - rect.x
+        dy = target.y - rect.y
+        if dx or dy:
+            distance = math.sqrt(dx * dx + dy * dy)
+            dx, dy = dx / distance, dy / distance
         return dx, dy
 
-    def update(self):
-        dx, dy = self.find_player()
-        if pg.sprite.collide_rect(self, self.player):
+    def update(self, touching=None, flow=None):
+        """
+        Moves toward the player.  When the caller has already resolved the
+        player collision through a broad-phase it passes the result in as
+        touching; otherwise the zombie checks on its own.
+        """
+        self.prev_pos = self.rect.topleft
+        dx, dy = self.find_player(flow)
+        if touching is None:
+            touching = pg.sprite.collide_rect(self, self.player)
+        if touching:
             self.attack_player()
         if self.player.is_alive():
             dx = round(dx) if dx != 0 else 0
@@ -444,29 +2455,957 @@ class Zombie(pg.sprite.Sprite):
                     newpos.y -= self.area.y
                 if self.area.contains(newpos):
                     self.rect = newpos
-            pg.event.pump()
+
+    def catch_up(self, ticks):
+        """
+        Moves ticks steps along the last heading in one go, for a zombie the
+        AIScheduler left alone for a while.  Stops at the edge of the area.
+        prev_pos ends up one step back, so drawing blends the last step.
+        """
+        if ticks > 0 and self.player.is_alive():
+            mx, my = self.movepos
+            rect = self.rect
+            rect.move_ip(mx * (ticks - 1), my * (ticks - 1))
+            rect.clamp_ip(self.area)
+            self.prev_pos = rect.topleft
+            rect.move_ip(mx, my)
+            rect.clamp_ip(self.area)
+
+    def attack_player(self):
+        self.player.health -= self.attack
+
+
+class AIScheduler(object):
+    """
+    Time-slices the horde's thinking.
+
+    The max_near zombies closest to the player within near_radius of it
+    run their full update every tick, and every zombie touching the player
+    attacks it every tick.  The rest are staggered over slices buckets by
+    their slot and only one bucket is visited per tick; a far zombie first
+    catches up on the ticks it sat out along its last heading, then
+    thinks.  In between its rect stays where it was and Horde.draw
+    extrapolates it from movepos and the ticks since it was synced, so it
+    still slides smoothly on screen.
+
+    With a budget (seconds per tick) a governor adds a bucket whenever the
+    thinking runs over and takes one away when it is comfortably under.
+    The budget covers the thinking only; the horde's grid rebuild is a
+    fixed cost on top.  That schedule follows wall-clock time, so a game
+    run with a budget is not replay-exact; without one the slicing is
+    fixed and deterministic.
+    """
+
+    def __init__(self, slices=1, near_radius=200, budget=None, max_slices=64, max_near=128):
+        self.slices = slices
+        self.near_radius = near_radius
+        self.budget = budget
+        self.max_slices = max_slices
+        self.max_near = max_near
+        self.tick = 0
+        self.thinking = 0
+        self.elapsed = 0.0
+
+    def nearest(self, horde):
+        """
+        The zombies that think every tick: the closest max_near within
+        near_radius of the player.
+        """
+        player = horde.player.rect
+        radius = self.near_radius
+        near = horde.grid.query_rect(player.inflate(radius * 2, radius * 2))
+        if len(near) <= self.max_near:
+            return near
+        px, py = player.center
+
+        def distance(zombie):
+            rect = zombie.rect
+            dx = rect.centerx - px
+            dy = rect.centery - py
+            return dx * dx + dy * dy
+
+        return heapq.nsmallest(self.max_near, near, key=distance)
+
+    def update(self, horde, touching, flow):
+        started = perf_counter()
+        self.tick = tick = self.tick + 1
+        near = self.nearest(horde)
+        for zombie in near:
+            zombie.catch_up(tick - zombie.synced - 1)
+            zombie.update(zombie in touching, flow)
+            zombie.synced = tick
+        thinking = len(near)
+        near = set(near)
+        # a pile on the player can outnumber max_near; the ones left out
+        # still bite every tick and only their moving is sliced
+        for zombie in touching:
+            if zombie not in near:
+                zombie.attack_player()
+        slices = self.slices
+        for zombie in horde[tick % slices::slices]:
+            if zombie not in near:
+                zombie.catch_up(tick - zombie.synced - 1)
+                zombie.update(False, flow)
+                zombie.synced = tick
+                thinking += 1
+        self.thinking = thinking
+        self.elapsed = perf_counter() - started
+        self.govern()
+
+    def catch_up(self, horde):
+        """
+        Brings every zombie that sat this tick out up to where it is drawn,
+        for anything that tests their rects, like bullets.
+        """
+        tick = self.tick
+        for zombie in horde:
+            if zombie.synced != tick:
+                zombie.catch_up(tick - zombie.synced)
+                zombie.synced = tick
+
+    def govern(self):
+        """
+        Adjusts the number of buckets to how long the last update took.
+        """
+        if self.budget is None:
+            return
+        if self.elapsed > self.budget:
+            # back off fast, by a quarter, and creep back one at a time
+            self.slices = min(self.slices + max(1, self.slices // 4), self.max_slices)
+        elif self.elapsed < self.budget / 2 and self.slices > 1:
+            self.slices -= 1
+
+
+class EntityPool(object):
+    """
+    Keeps released entities around so they can be handed out again.
+
+    factory builds a fresh, inactive entity; whoever acquires one is
+    responsible for resetting it.
+    """
+
+    def __init__(self, factory, size=0):
+        self.factory = factory
+        self.free = []
+        self.created = 0
+        self.reserve(size)
+
+    def reserve(self, size):
+        """
+        Tops the free list up to at least size entities.
+        """
+        while len(self.free) < size:
+            self.free.append(self.factory())
+            self.created += 1
+
+    def acquire(self):
+        if self.free:
+            return self.free.pop()
+        self.created += 1
+        return self.factory()
+
+    def release(self, entity):
+        self.free.append(entity)
+
+    def release_all(self, entities):
+        self.free.extend(entities)
+
+
+class Horde(list):
+    """
+    The classic horde: a list of Zombie sprites sharing one broad-phase.
+
+    Zombies come from an EntityPool and go back to it when they die or the
+    horde is cleared for a restart.  Every zombie knows its slot in the
+    list, so killing one is a swap with the last rather than a search.
+    """
+
+    def __init__(self, player, logger=None, pool=None, pool_size=256):
+        list.__init__(self)
+        self.player = player
+        self.logger = logger if logger is not None else LoggerFacade()
+        self.grid = SpatialGrid()
+        self.flow = None
+        self.scheduler = None
+        self.dying = []
+        if pool is None:
+            pool = EntityPool(lambda: Zombie(None, self.logger), pool_size)
+        self.pool = pool
+
+    def spawn(self):
+        zombie = self.pool.acquire()
+        zombie.reset(self.player)
+        zombie.slot = len(self)
+        if self.scheduler is not None:
+            zombie.synced = self.scheduler.tick
+        self.append(zombie)
+        return zombie
+
+    def kill(self, zombie):
+        """
+        Removes a zombie by moving the last one into its slot.
+        """
+        last = self.pop()
+        if last is not zombie:
+            self[zombie.slot] = last
+            last.slot = zombie.slot
+        self.pool.release(zombie)
+
+    def clear(self):
+        self.pool.release_all(self)
+        del self[:]
+        del self.dying[:]
+
+    def prepare_hits(self):
+        """
+        Re-buckets the horde where it stands now, before bullets are tested.
+        """
+        if self.scheduler is not None:
+            # bullets must hit zombies where they are drawn
+            self.scheduler.catch_up(self)
+        self.grid.rebuild(self)
+
+    def first_hit(self, x0, y0, x1, y1):
+        """
+        The first living zombie on the segment from (x0, y0) to (x1, y1).
+        """
+        for zombie in self.grid.query_segment(x0, y0, x1, y1):
+            if zombie.health > 0:
+                return zombie
+        return None
+
+    def damage(self, zombie, amount):
+        zombie.health -= amount
+        if zombie.health <= 0:
+            self.dying.append(zombie)
+
+    def remove_dead(self):
+        """
+        Removes the zombies killed since the last call; returns how many.
+        """
+        dying = self.dying
+        for zombie in dying:
+            self.kill(zombie)
+        killed = len(dying)
+        del dying[:]
+        return killed
+
+    def update(self):
+        self.grid.rebuild(self)
+        touching = set(self.grid.query_rect(self.player.rect))
+        flow = self.flow
+        if self.scheduler is not None:
+            self.scheduler.update(self, touching, flow)
+            return
+        for zombie in self:
+            zombie.update(zombie in touching, flow)
+
+    def draw(self, surface, alpha=1.0, view=None):
+        """
+        Draws every zombie, blended alpha of the way from its previous
+        simulated position to its current one.  With a view rect, zombies
+        outside it are skipped and the rest are offset to the view.
+        """
+        if self.scheduler is not None:
+            commands = self.extrapolated(alpha, view)
+        elif view is not None:
+            vx, vy = view.topleft
+            commands = []
+            for zombie in self:
+                rect = zombie.rect
+                if view.colliderect(rect):
+                    x, y = interpolate(zombie.prev_pos, rect.topleft, alpha)
+                    commands.append((zombie.image, (x - vx, y - vy)))
+        elif alpha >= 1:
+            commands = [(zombie.image, zombie.rect.topleft) for zombie in self]
+        else:
+            commands = [
+                (zombie.image, interpolate(zombie.prev_pos, zombie.rect.topleft, alpha))
+                for zombie in self
+            ]
+        surface.blits(commands, doreturn=False)
+
+    def extrapolated(self, alpha, view=None):
+        """
+        Blit commands for a time-sliced horde: zombies brought up to date
+        this tick blend as usual, the rest are pushed on along their heading by
+        the ticks they have sat out.
+        """
+        vx, vy = view.topleft if view is not None else (0, 0)
+        tick = self.scheduler.tick
+        commands = []
+        for zombie in self:
+            rect = zombie.rect
+            if view is not None and not view.colliderect(rect):
+                continue
+            lag = tick - zombie.synced
+            if lag:
+                mx, my = zombie.movepos
+                ahead = lag - 1 + alpha
+                x, y = rect.x + mx * ahead, rect.y + my * ahead
+            else:
+                x, y = interpolate(zombie.prev_pos, rect.topleft, alpha)
+            commands.append((zombie.image, (x - vx, y - vy)))
+        return commands
+
+
+def _swarm_field(name):
+    def getter(self):
+        return getattr(self.swarm, name)[self.index].item()
+
+    def setter(self, value):
+        getattr(self.swarm, name)[self.index] = value
+    return property(getter, setter)
+
+
+class SwarmZombie(object):
+    """
+    A thin, Zombie-like view onto one slot of a ZombieSwarm.
+
+    Views address their slot by index, so they go stale once the swarm
+    removes a zombie and moves another into that slot.
+    """
+    __slots__ = ('swarm', 'index')
+
+    def __init__(self, swarm, index):
+        self.swarm = swarm
+        self.index = index
+
+    x = _swarm_field('x')
+    y = _swarm_field('y')
+    speed = _swarm_field('speed')
+    health = _swarm_field('health')
+    attack = _swarm_field('attack')
+
+    @property
+    def image(self):
+        return self.swarm.image
+
+    @property
+    def player(self):
+        return self.swarm.player
+
+    @property
+    def rect(self):
+        w, h = self.swarm.size
+        return pg.Rect(self.x, self.y, w, h)
+
+    @rect.setter
+    def rect(self, value):
+        value = pg.Rect(value)
+        self.x = value.x
+        self.y = value.y
 
     def attack_player(self):
         self.player.health -= self.attack
 
+
+class ZombieSwarm(object):
+    """
+    Struct-of-arrays horde backed by NumPy.
+
+    Positions, speed, health and attack live in parallel arrays and the
+    whole horde seeks, collides and moves in one vectorized pass per frame,
+    following the same rules as Zombie.update.
+    """
+
+    FIELDS = ('x', 'y', 'speed', 'health', 'attack', 'prev_x', 'prev_y')
+
+    def __init__(self, player, logger=None, capacity=1024):
+        if np is None:
+            raise RuntimeError('ZombieSwarm requires numpy')
+        self.logger = logger if logger is not None else LoggerFacade()
+        self.sheet = assets.sprite_sheet('zombie')
+        self.image, rect = self.sheet[(0, 0)]
+        self.size = rect.size
+        self.area = player.area
+        self.player = player
+        self.flow = None
+        self.count = 0
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.speed = np.zeros(capacity, dtype=np.int32)
+        self.health = np.zeros(capacity, dtype=np.int32)
+        self.attack = np.zeros(capacity, dtype=np.int32)
+        self.prev_x = np.zeros(capacity, dtype=np.int32)
+        self.prev_y = np.zeros(capacity, dtype=np.int32)
+        self.dying = []
+        self.hit_cell_size = 64
+        self.hit_cells = {}
+        self.hit_order = []
+        self.hit_x = []
+        self.hit_y = []
+        self.hit_health = []
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return SwarmZombie(self, index)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield SwarmZombie(self, index)
+
+    def _grow(self):
+        capacity = len(self.x) * 2
+        for name in self.FIELDS:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def spawn(self):
+        """
+        Adds a zombie at a random corner, the same way Zombie.spawn does.
+        """
+        wx = self.area[2]
+        wy = self.area[3]
+        x = random.randint(0, wx - 1)
+        y = random.randint(0, wy - 1)
+        x = 0 if x < (wx / 2.0) else wx - 24
+        y = 0 if y < (wy / 2.0) else wy - 24
+        if self.count == len(self.x):
+            self._grow()
+        index = self.count
+        self.x[index] = self.prev_x[index] = x
+        self.y[index] = self.prev_y[index] = y
+        self.speed[index] = 2
+        self.health[index] = 1
+        self.attack[index] = 1
+        self.count += 1
+        return SwarmZombie(self, index)
+
+    def clear(self):
+        """
+        Empties the swarm; the arrays are kept for the next run.
+        """
+        self.count = 0
+        del self.dying[:]
+
+    def remove(self, index):
+        """
+        Removes a zombie by moving the last one into its slot.
+        """
+        last = self.count - 1
+        if index != last:
+            for name in self.FIELDS:
+                array = getattr(self, name)
+                array[index] = array[last]
+        self.count = last
+
+    def prepare_hits(self):
+        """
+        Buckets the swarm by grid cell for bullet tests: zombie indices are
+        sorted by cell in one vectorized pass and each cell maps to its run
+        in that order.
+        """
+        count = self.count
+        x = self.x[:count]
+        y = self.y[:count]
+        size = self.hit_cell_size
+        keys = (x // size).astype(np.int64) * 65536 + y // size
+        order = np.argsort(keys, kind='stable')
+        cells, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        self.hit_cells = dict(zip(cells.tolist(), zip(starts.tolist(), (starts + counts).tolist())))
+        self.hit_order = order.tolist()
+        self.hit_x = x.tolist()
+        self.hit_y = y.tolist()
+        self.hit_health = self.health[:count].tolist()
+
+    def first_hit(self, x0, y0, x1, y1):
+        """
+        Index of the first living zombie on the segment from (x0, y0) to
+        (x1, y1), or None.
+        """
+        w, h = self.size
+        size = self.hit_cell_size
+        cells = self.hit_cells
+        order = self.hit_order
+        xs = self.hit_x
+        ys = self.hit_y
+        health = self.hit_health
+        best = None
+        best_distance = None
+        for cx in range((min(x0, x1) - w) // size, max(x0, x1) // size + 1):
+            for cy in range((min(y0, y1) - h) // size, max(y0, y1) // size + 1):
+                cell = cells.get(cx * 65536 + cy)
+                if cell is None:
+                    continue
+                for index in order[cell[0]:cell[1]]:
+                    if health[index] <= 0:
+                        continue
+                    clipped = pg.Rect(xs[index], ys[index], w, h).clipline(x0, y0, x1, y1)
+                    if clipped:
+                        (hx, hy), _ = clipped
+                        distance = (hx - x0) ** 2 + (hy - y0) ** 2
+                        if best is None or distance < best_distance:
+                            best = index
+                            best_distance = distance
+        return best
+
+    def damage(self, index, amount):
+        self.health[index] -= amount
+        self.hit_health[index] -= amount
+        if self.hit_health[index] <= 0:
+            self.dying.append(index)
+
+    def remove_dead(self):
+        """
+        Removes the zombies killed since the last call; returns how many.
+        Highest index first, so every swap moves in a zombie that stays.
+        """
+        dying = self.dying
+        for index in sorted(dying, reverse=True):
+            self.remove(index)
+        killed = len(dying)
+        del dying[:]
+        return killed
+
+    def update(self):
+        count = self.count
+        if not count:
+            return
+        x = self.x[:count]
+        y = self.y[:count]
+        self.prev_x[:count] = x
+        self.prev_y[:count] = y
+        w, h = self.size
+        prect = self.player.rect
+        touching = ((x < prect.right) & (prect.x < x + w) &
+                    (y < prect.bottom) & (prect.y < y + h))
+        for attack in self.attack[:count][touching].tolist():
+            self.player.health -= attack
+        if not self.player.is_alive():
+            return
+        dx = prect.x - x
+        dy = prect.y - y
+        distance = np.hypot(dx, dy)
+        distance[distance == 0] = 1
+        step_x = np.rint(dx / distance).astype(np.int32)
+        step_y = np.rint(dy / distance).astype(np.int32)
+        flow = self.flow
+        if flow is not None:
+            flow_x, flow_y = flow.as_arrays()
+            cx = (x + w // 2 - flow.area.x) // flow.cell_size
+            cy = (y + h // 2 - flow.area.y) // flow.cell_size
+            fx = flow_x[cy, cx]
+            fy = flow_y[cy, cx]
+            moving = (fx != 0) | (fy != 0)
+            step_x = np.where(moving, fx, step_x)
+            step_y = np.where(moving, fy, step_y)
+        speed = self.speed[:count]
+        nx = x + step_x * speed
+        ny = y + step_y * speed
+        area = self.area
+        inside = ((nx >= area.left) & (ny >= area.top) &
+                  (nx + w <= area.right) & (ny + h <= area.bottom))
+        np.copyto(x, nx, where=inside)
+        np.copyto(y, ny, where=inside)
+
+    def draw(self, surface, alpha=1.0, view=None):
+        image = self.image
+        count = self.count
+        x = self.x[:count]
+        y = self.y[:count]
+        prev_x = self.prev_x[:count]
+        prev_y = self.prev_y[:count]
+        if view is not None:
+            w, h = self.size
+            visible = ((x < view.right) & (view.x < x + w) &
+                       (y < view.bottom) & (view.y < y + h))
+            x = x[visible] - view.x
+            y = y[visible] - view.y
+            prev_x = prev_x[visible] - view.x
+            prev_y = prev_y[visible] - view.y
+        if alpha < 1:
+            x = np.rint(prev_x + (x - prev_x) * alpha).astype(np.int32)
+            y = np.rint(prev_y + (y - prev_y) * alpha).astype(np.int32)
+        surface.blits(
+            [(image, pos) for pos in zip(x.tolist(), y.tolist())],
+            doreturn=False,
+        )
+
+
+class Game(object):
+    """
+    Simulation state for one run: the player, the horde and the spawn timer.
+
+    step advances the world by exactly one fixed tick; how often it gets
+    called is up to the loop driving it.
+
+    Every game seeds the random module itself, so a seed plus the key
+    events applied before each tick is enough to replay it exactly.
+
+    tuning overrides any of the TUNING knobs for this game.
+
+    world_size makes the playfield a scrolling world of that size instead
+    of the window; the view then follows the player through a Camera and
+    the ground is drawn from a TileCache.  The simulation never looks at
+    the camera, so a game plays the same with or without a display.
+
+    ai_budget (milliseconds) hands the sprite horde an AIScheduler that
+    time-slices far zombies to keep their update within that budget.
+    """
+
+    TUNING = {
+        'spawn_rate': 160,       # ticks between spawns at the start
+        'spawn_rate_step': 20,   # how much sooner each next spawn comes
+        'spawn_rate_min': 21,    # stop speeding up once at or below this
+        'zombie_speed': 2,       # pixels per tick
+        'player_speed': 10,      # pixels per tick
+    }
+
+    def __init__(self, logger=None, use_swarm=False, seed=None, recorder=None, playback=None,
+                 flow_field=False, tuning=None, world_size=None, ai_budget=None):
+        self.tuning = dict(self.TUNING)
+        if tuning:
+            unknown = set(tuning) - set(self.TUNING)
+            if unknown:
+                raise ValueError('Unknown tuning: %s' % ', '.join(sorted(unknown)))
+            self.tuning.update(tuning)
+        self.logger = logger if logger is not None else LoggerFacade()
+        self.use_swarm = use_swarm
+        self.flow_field = flow_field
+        self.flow = None
+        self.ai_budget = ai_budget
+        self.recorder = recorder
+        self.finished = True
+        screen = pg.display.get_surface().get_rect()
+        self.world = None
+        self.camera = None
+        self.tiles = None
+        if world_size is not None:
+            self.world = pg.Rect((0, 0), world_size)
+            self.camera = Camera(screen.size, self.world)
+            self.tiles = TileCache(self.world, self.camera)
+        self.bullets = None
+        self.player = None
+        self.zombies = None
+        self.reset(seed, playback)
+
+    def reset(self, seed=None, playback=None):
+        if not self.finished:
+            self.finish()
+        if playback is not None:
+            seed = playback.seed
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.playback = playback
+        random.seed(seed)
+        self.finished = False
+        self.ticks = 0
+        self.kills = 0
+        self.spawn_timer = 0
+        self.spawn_rate = self.tuning['spawn_rate']
+        # The player and horde outlive a restart; only their state resets
+        if self.player is None:
+            self.bullets = Projectiles(self.world or pg.display.get_surface().get_rect())
+            self.player = Player(self.bullets, self.logger, self.world)
+            if self.use_swarm:
+                self.zombies = ZombieSwarm(self.player, self.logger)
+            else:
+                self.zombies = Horde(self.player, self.logger)
+                if self.ai_budget is not None:
+                    self.zombies.scheduler = AIScheduler(budget=self.ai_budget / 1000.0)
+            self.player.zombies = self.zombies
+            if self.flow_field:
+                self.flow = FlowField(self.player.area)
+                self.zombies.flow = self.flow
+        else:
+            self.bullets.clear()
+            self.zombies.clear()
+            self.player.setup()
+        self.player.speed = self.tuning['player_speed']
+        self.spawn()
+        if self.recorder is not None:
+            self.recorder.start_game(seed)
+
+    def finish(self):
+        """
+        Marks the game as over; closes its entry in the recording.
+        """
+        if not self.finished and self.recorder is not None:
+            self.recorder.end_game(self.ticks, self.score)
+        self.finished = True
+
+    def spawn(self):
+        zombie = self.zombies.spawn()
+        zombie.speed = self.tuning['zombie_speed']
+        return zombie
+
+    @property
+    def score(self):
+        return int(round(self.player.score))
+
+    @property
+    def replay_done(self):
+        playback = self.playback
+        return playback is not None and playback.end_tick is not None and self.ticks >= playback.end_tick
+
+    def handle_event(self, event):
+        """
+        Feeds live input to the player; ignored while replaying.
+        """
+        if self.playback is not None:
+            return
+        self.player.handle_event(event)
+        if self.recorder is not None and event.type in (KEY_PRESSED, KEY_RELEASED):
+            if event.key in key_actions:
+                self.recorder.event(self.ticks, event)
+
+    def step(self, timer=None):
+        """
+        Advances one tick.  Raises PlayerDied when the player runs out of
+        health.  A FrameTimer, when given, gets a mark after each phase.
+        """
+        if self.playback is not None:
+            for event in self.playback.events.get(self.ticks, ()):
+                self.player.handle_event(event)
+        self.ticks += 1
+        self.spawn_timer += 1
+        if self.spawn_timer > self.spawn_rate:
+            self.spawn_timer = 0
+            if self.spawn_rate > self.tuning['spawn_rate_min']:
+                self.spawn_rate -= self.tuning['spawn_rate_step']
+            self.spawn()
+        if timer is not None:
+            timer.mark('spawn')
+        self.player.update()
+        if self.flow is not None:
+            self.flow.update(self.player.rect.center)
+        if timer is not None:
+            timer.mark('player')
+        self.zombies.update()
+        if timer is not None:
+            timer.mark('zombies')
+        self.kills += self.bullets.update(self.zombies)
+        if timer is not None:
+            timer.mark('bullets')
+
+    def follow(self, alpha=1.0):
+        """
+        Points the camera at where the player is drawn this frame.  Returns
+        True when the view moved, i.e. the whole screen needs repainting.
+        """
+        if self.camera is None:
+            return False
+        player = self.player
+        x, y = interpolate(player.prev_pos, player.rect.topleft, alpha)
+        return self.camera.follow((x + player.rect.w // 2, y + player.rect.h // 2))
+
+    def draw(self, queue, alpha=1.0):
+        """
+        Queues the frame's draw commands on a RenderQueue; the caller
+        flushes it.
+        """
+        player = self.player
+        pos = interpolate(player.prev_pos, player.rect.topleft, alpha)
+        # only what the camera sees is drawn
+        view = self.camera.rect if self.camera is not None else None
+        self.zombies.draw(queue.layer(LAYER_ZOMBIES), alpha, view)
+        self.bullets.draw(queue.layer(LAYER_BULLETS), alpha, view)
+        if view is not None:
+            pos = self.camera.to_screen(pos)
+        queue.layer(LAYER_PLAYER).blit(player.image, pos)
+
+
+def init_headless_display(size=(800, 600)):
+    """
+    Sets up SDL's dummy video driver so the game can run without a window.
+    Entities still need a display surface to measure their play area.
+    """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    pg.display.init()
+    return pg.display.set_mode(size)
+
+
+def run_headless(ticks=None, use_swarm=False, seed=None, logger=None, playback=None,
+                 flow_field=False, tuning=None, startup=None, world_size=None):
+    """
+    Runs one game with no display flips and no frame limiter until the
+    player dies or the tick budget is spent.  Returns a summary dict.
+
+    With a Playback the recorded game is re-run instead, up to the tick it
+    was recorded to.  A StartupReport, when given, gets the display and
+    game setup marked on it.
+    """
+    if seed is not None:
+        random.seed(seed)
+    if pg.display.get_surface() is None:
+        init_headless_display()
+    if startup is not None:
+        startup.mark('display')
+    if playback is not None and playback.end_tick is not None:
+        ticks = playback.end_tick
+    game = Game(logger, use_swarm, playback=playback, flow_field=flow_field, tuning=tuning,
+                world_size=world_size)
+    if startup is not None:
+        startup.mark('game')
+    zombies = game.zombies
+    peak = len(zombies)
+    died = False
+    start = time.time()
+    try:
+        while ticks is None or game.ticks < ticks:
+            game.step()
+            if len(zombies) > peak:
+                peak = len(zombies)
+    except PlayerDied:
+        died = True
+    elapsed = time.time() - start
+    return {
+        'seed': game.seed,
+        'ticks': game.ticks,
+        'seconds': elapsed,
+        'ticks_per_second': game.ticks / elapsed if elapsed > 0 else float('inf'),
+        'score': game.score,
+        'zombies': len(game.zombies),
+        'peak_zombies': peak,
+        'kills': game.kills,
+        'died': died,
+    }
+
+
+def load_hud(debug=False):
+    """
+    Fonts and pre-rendered text for the HUD: (small font, big font, digits).
+    """
+    small = asset_cache.font(HUD_FONT, 15)
+    big = asset_cache.font(HUD_FONT, 45)
+    if debug:
+        # the real font is only needed for uncached text (the debug
+        # overlay); loading it here keeps that off the frame loop too
+        small.font
+    big.render("GAME OVER", 1, HUD_COLOR)
+    return small, big, GlyphAtlas(small, HUD_COLOR)
+
+
+def startup_assets(debug=False):
+    """
+    Loading jobs for everything the first frame of a game needs.
+    """
+    return [
+        ('asset cache', asset_cache.open),
+        ('player sprites', lambda: assets.sprite_sheet('player')),
+        ('zombie sprites', lambda: assets.sprite_sheet('zombie')),
+        ('animations', assets.animation_atlas),
+        ('hud', lambda: load_hud(debug)),
+    ]
+
+
+def show_loading_screen(window, loader, frames_per_second=60):
+    """
+    Draws a progress bar until loader is done.  Returns False if the
+    window was closed or Escape pressed in the meantime.
+    """
+    bar = pg.Rect(0, 0, window.get_width() // 2, 12)
+    bar.center = window.get_rect().center
+    while not loader.done:
+        for event in pg.event.get():
+            if event.type == pg.QUIT:
+                return False
+            if event.type == KEY_PRESSED and event.key == pg.K_ESCAPE:
+                return False
+        window.fill((0, 0, 0), bar)
+        pg.draw.rect(window, HUD_COLOR, bar, 1)
+        filled = bar.inflate(-4, -4)
+        filled.w = int(filled.w * loader.progress)
+        window.fill(HUD_COLOR, filled)
+        pg.display.update(bar)
+        # wakes up as soon as the loader finishes rather than on the tick
+        loader.thread.join(1.0 / frames_per_second)
+    return True
+
+
 def main(args):
+    startup = StartupReport()
     # Setup the logging
-    dbg = args.get('debug')
+    dbg = args.get('--debug') or args.get('debug')
     logger = logging.getLogger(__file__) if dbg else LoggerFacade()
     if not isinstance(logger, LoggerFacade):
         if dbg:
             logging.basicConfig(level=logging.DEBUG)
         else:
             logging.basicConfig(level=logging.INFO)
+    use_swarm = bool(args.get('--swarm'))
+    if use_swarm and np is None:
+        logger.warning('numpy is not installed; using the sprite horde')
+        use_swarm = False
 
-    # Create a window
-    pg.init()
-    pg.font.init()
-    font_path = "resources/Tahoma.ttf"
-    font_path = font_path if os.path.exists(font_path) else None
-    myfont = pg.font.Font(font_path, 15)
-    bigfont = pg.font.Font(font_path, 45)
+    flow_field = bool(args.get('--flow-field'))
+    try:
+        # a world has to hold at least a sprite
+        world_size = parse_size(args['--world'], minimum=24) if args.get('--world') else None
+    except ValueError as error:
+        sys.exit('--world: %s' % error)
+    try:
+        ai_budget = parse_positive(args['--ai-budget']) if args.get('--ai-budget') else None
+    except ValueError as error:
+        sys.exit('--ai-budget: %s' % error)
+    if ai_budget is not None and use_swarm:
+        logger.warning('--ai-budget only applies to the sprite horde; the swarm is vectorized')
+        ai_budget = None
+    try:
+        tick_rate = parse_positive(args.get('--tick-rate') or 60)
+    except ValueError as error:
+        sys.exit('--tick-rate: %s' % error)
+    replay = args.get('--replay')
+    if ai_budget is not None and (args.get('--record') or replay):
+        # the budgeted schedule follows the wall clock, so the game would
+        # drift from its recording
+        sys.exit('--ai-budget runs do not replay exactly; '
+                 'it cannot be used with --record or --replay')
+
+    if args.get('--build-assets'):
+        entries = asset_cache.build()
+        sys.stdout.write("Wrote %d assets to %s\n" % (len(entries), asset_cache.path))
+        return entries
+    playbacks = load_replay(replay) if replay else None
+
+    if args.get('--headless'):
+        ticks = args.get('--ticks')
+        seed = args.get('--seed')
+        report = (
+            "ticks: %(ticks)s  seconds: %(seconds).3f  "
+            "ticks/s: %(ticks_per_second).1f  score: %(score)s  "
+            "zombies: %(zombies)s  kills: %(kills)s  died: %(died)s"
+        )
+        results = []
+        for playback in (playbacks or [None]):
+            result = run_headless(
+                ticks=int(ticks) if ticks is not None else None,
+                use_swarm=use_swarm,
+                seed=int(seed) if seed is not None else None,
+                logger=logger,
+                playback=playback,
+                flow_field=flow_field,
+                startup=startup if not results else None,
+                world_size=world_size,
+            )
+            if dbg and not results:
+                logger.debug(startup.format())
+            line = report % result
+            if playback is not None and playback.score is not None:
+                matches = (result['ticks'], result['score']) == (playback.end_tick, playback.score)
+                line += "  replay: %s" % ('ok' if matches else 'MISMATCH (recorded %s ticks, score %s)' % (
+                    playback.end_tick, playback.score))
+            sys.stdout.write(line + "\n")
+            results.append(result)
+        pg.quit()
+        return results if playbacks else results[0]
 
+    record = args.get('--record')
+    recorder = InputRecorder(record) if record else None
+
+    # Create a window.  Only the display is initialized up front; fonts
+    # start on first use, and nothing else (audio, joysticks) is used.
+    pg.display.init()
     window = pg.display.set_mode((800, 600))
     # Add Background
     background = pg.Surface(window.get_size())
@@ -474,16 +3413,52 @@ def main(args):
     background.fill((0, 0, 0))
     window.blit(background, (0, 0))
     pg.display.set_caption('Flee')
+    renderer = DirtyRenderer(window, background)
+    queue = RenderQueue(check_formats=bool(dbg))
+    hud = queue.layer(LAYER_HUD)
+    inputs = InputStage()
+    inputs.install()
+    startup.mark('display')
+
+    # Decode everything on a worker thread behind a loading screen; the
+    # game only starts once all of it is in memory
+    pg.font.init()
+    loader = AssetLoader(startup_assets(bool(dbg))).start()
+    if not show_loading_screen(window, loader):
+        loader.stop()
+        if recorder is not None:
+            recorder.close()
+        pg.quit()
+        return
+    myfont, bigfont, digits = loader.wait()['hud']
+    score_label = HudLabel(digits, "Score: ")
+    zombie_label = HudLabel(digits, "Zombies: ")
+    startup.mark('assets')
+    if dbg:
+        logger.debug(loader.report())
+
+    # Debug mode times every phase of the loop and keeps a rolling profile
+    timer = profile = overlay = None
+    if dbg:
+        timer = FrameTimer(history=240)
+        profile = RollingProfile(seconds=float(args.get('--profile-seconds') or 10))
+        overlay = ProfilerOverlay(timer, myfont)
+        profile.start()
 
-    # player_sprites = pg.sprite.RenderPlain(player)
+    # The simulation runs in fixed ticks; rendering runs as fast as the
+    # frame limiter allows and interpolates between the last two ticks.
     clock = pg.time.Clock()
     frames_per_second = 60
-    frames = 0
+    tick_length = 1.0 / tick_rate
+    max_catchup_ticks = 5
+    max_frame_time = 0.25
+    accumulator = 0.0
 
     running = True
     player_has_died = None
+    game = None
     while running:
-        clock.tick(frames_per_second)
+        frame_time = min(clock.tick(frames_per_second) / 1000.0, max_frame_time)
         if player_has_died is not False:
             # restart
             if player_has_died is True:
@@ -493,64 +3468,122 @@ def main(args):
                     event = pg.event.wait()
                     etype = event.type
             player_has_died = False
-            spawn_rate = 160
-            bullets = []
-            player = Player(bullets, logger)
-            zombies = [Zombie(player, window)]
-            player.zombies = zombies
-            spawn_rate = 160
+            playback = None
+            if playbacks is not None:
+                if not playbacks:
+                    break
+                playback = playbacks.pop(0)
+            if game is None:
+                game = Game(logger, use_swarm, recorder=recorder, playback=playback,
+                            flow_field=flow_field, world_size=world_size, ai_budget=ai_budget)
+                renderer.backdrop = game.tiles
+                # everything allocated so far lives for the whole session;
+                # keep the collector from rescanning it
+                if hasattr(gc, 'freeze'):
+                    gc.collect()
+                    gc.freeze()
+                startup.mark('game')
+            else:
+                game.reset(playback=playback)
+            accumulator = 0.0
+            frame_time = 0.0
+            renderer.invalidate()
+        if timer is not None:
+            timer.begin()
+            profile.tick()
         try:
-            frames += 1
-            if frames > spawn_rate:
-                frames = 0
-                if spawn_rate > 21:
-                    spawn_rate -= 20
-                zombies.append(Zombie(player, window))
-
             # Handle Events
-            for event in pg.event.get():
-                player.handle_event(event)
+            for event in inputs.poll():
+                if event.type in inputs.EXPOSE_TYPES:
+                    renderer.invalidate()
+                    continue
+                game.handle_event(event)
                 if event.type in keyboard_events:
                     if event.key == pg.K_ESCAPE:
                         logging.debug('ESCAPE pressed.  Quitting')
                         running = False
+                    elif timer is not None and event.type == pg.KEYDOWN:
+                        if event.key == pg.K_F1:
+                            overlay.visible = not overlay.visible
+                        elif event.key == pg.K_F2:
+                            path = 'flee-%s.pstats' % time.strftime('%Y%m%d-%H%M%S')
+                            profile.dump(path)
+                            logger.debug('Wrote profile to %s' % path)
                 if hasattr(event, 'type') and event.type == pg.QUIT:
                     running = False
+            if timer is not None:
+                timer.mark('events')
+
+            # Advance the simulation
+            accumulator += frame_time
+            ticks = 0
+            while accumulator >= tick_length and ticks < max_catchup_ticks:
+                if game.replay_done:
+                    running = False
+                    break
+                game.step(timer)
+                accumulator -= tick_length
+                ticks += 1
+            if ticks == max_catchup_ticks:
+                # too far behind; drop the backlog rather than spiral
+                accumulator = min(accumulator, tick_length)
+            alpha = accumulator / tick_length
+            if game.follow(alpha):
+                renderer.invalidate()
 
             # Update display
-            score = int(round(player.score))
-            label = myfont.render("Score: %s" % score, 1, (255,255,127))
-            zcount = len(zombies)
-            zlabel = myfont.render("Zombies: %s" % zcount, 1, (255,255,127))
-            window.blit(background, (0, 0))
-            player.update()
-            [z.update() for z in zombies]            
-            [window.blit(z.image, z.rect) for z in zombies]
-            window.blit(player.image, player.rect)
-            window.blit(label, (window.get_rect().w - label.get_rect().w - 10, 10))
-            window.blit(zlabel, (10, 10))
+            label = score_label.set(game.score)
+            zlabel = zombie_label.set(len(game.zombies))
+            if timer is not None:
+                timer.mark('text')
+            renderer.begin()
+            game.draw(queue, alpha)
+            hud.blit(label, (window.get_rect().w - label.get_rect().w - 10, 10))
+            hud.blit(zlabel, (10, 10))
+            if overlay is not None:
+                overlay.draw(hud, (10, window.get_rect().h - 250))
+            queue.flush(renderer)
+            if timer is not None:
+                timer.mark('blit')
         except PlayerDied:
             player_has_died = True
-            score = int(round(player.score))
-            label = myfont.render("Score: %s" % score, 1, (255,255,127))
-            zcount = len(zombies)
-            zlabel = myfont.render("Zombies: %s" % zcount, 1, (255,255,127))
-            window.blit(label, (window.get_rect().w - label.get_rect().w - 10, 10))
-            window.blit(zlabel, (10, 10))
-            game_over = bigfont.render("GAME OVER", 1, (255, 255, 127))
+            game.finish()
+            label = score_label.set(game.score)
+            zlabel = zombie_label.set(len(game.zombies))
+            renderer.begin()
+            hud.blit(label, (window.get_rect().w - label.get_rect().w - 10, 10))
+            hud.blit(zlabel, (10, 10))
+            game_over = bigfont.render("GAME OVER", 1, HUD_COLOR)
             wrect = window.get_rect()
             grect = game_over.get_rect()
-            window.blit(game_over, (wrect.w/2.0 - grect.w/2.0, wrect.h/2.0 - grect.h/2.0))
-        pg.display.update()
+            hud.blit(game_over, (wrect.w/2.0 - grect.w/2.0, wrect.h/2.0 - grect.h/2.0))
+            queue.flush(renderer)
+        renderer.present()
+        if startup is not None:
+            startup.mark('first frame')
+            if dbg:
+                logger.debug(startup.format())
+            startup = None
+        if timer is not None:
+            timer.mark('display')
+            timer.end()
+    if profile is not None:
+        profile.stop()
+    if game is not None:
+        game.finish()
+    if recorder is not None:
+        recorder.close()
     pg.quit()
     logger.debug('Done.')
 
+# End of the import, for the startup report
+import_finished = perf_counter()
+
 if __name__ == "__main__":
     try:
         from docopt import docopt
-
-        args = docopt(__doc__, version=VERSION)
-        main(args)
-    except:
+    except ImportError:
         args = {'debug': False}
-        main(args)
+    else:
+        args = docopt(__doc__, version=VERSION)
+    main(args)